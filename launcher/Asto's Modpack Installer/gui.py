@@ -1,8 +1,6 @@
 import sys
-import json
 from pathlib import Path
 from typing import Dict, Any
-from urllib.parse import urlparse
 
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from PyQt6.QtWidgets import (
@@ -14,50 +12,36 @@ from PyQt6.QtWidgets import (
     QListWidget,
     QCheckBox,
     QPushButton,
+    QHBoxLayout,
     QProgressBar,
     QMessageBox,
 )
 
 # Используем те же utils, что и в CLI, чтобы избежать циклического импорта main.py
-from utils import downloader, installer, logger, gitpack_sync
+from utils import logger, engine, modlist_cache, installer
 
 # Пути такие же, как в main.py
 BASE_DIR = Path(__file__).resolve().parent
-LAUNCHER_DIR = BASE_DIR.parent
-DOWNLOADS_DIR = BASE_DIR / ".cache" / "downloads"
-GITHUB_ZIP_PATH = BASE_DIR / ".cache" / "github_config.zip"
-GITHUB_EXTRACT_DIR = BASE_DIR / ".cache" / "github_config"
-MODS_DIR = LAUNCHER_DIR / "mods"
-CACHE_DIR = BASE_DIR / ".cache"
-OVERWRITE_DIR = LAUNCHER_DIR / "overwrite"
-PROFILES_DIR = LAUNCHER_DIR / "profiles"
-
-for path in [DOWNLOADS_DIR, GITHUB_EXTRACT_DIR, MODS_DIR]:
-    path.mkdir(parents=True, exist_ok=True)
+PATHS = engine.InstallPaths(BASE_DIR)
+PATHS.ensure()
 
 
 def load_config() -> Dict[str, Any]:
     config_path = BASE_DIR / "config.json"
     try:
-        with open(config_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return modlist_cache.load_config(config_path, PATHS.modlist_cache_dir)
     except Exception as e:
         logger.error(f"Ошибка при чтении конфигурации: {e}")
         QMessageBox.critical(None, "Ошибка", f"Не удалось прочитать config.json: {e}")
         sys.exit(1)
 
 
-def download_modlist(modpack: Dict[str, Any]) -> Dict[str, Any]:
-    modlist_url = modpack.get("modlist_url")
-    if not modlist_url:
-        raise RuntimeError(f"URL модлиста не указан для модпака: {modpack['name']}")
-
-    modlist_path = DOWNLOADS_DIR / f"{modpack['slug']}_modlist.json"
-
-    logger.info(f"Скачиваю модлист для {modpack['name']}...")
-    downloader.download_file(modlist_url, modlist_path)
-    with open(modlist_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+STAGE_LABELS = {
+    engine.STAGE_PREPARE: "Подготовка",
+    engine.STAGE_DOWNLOAD: "Скачиваю",
+    engine.STAGE_EXTRACT: "Распаковываю",
+    engine.STAGE_META: "Создаю meta.ini",
+}
 
 
 class InstallWorker(QThread):
@@ -65,76 +49,73 @@ class InstallWorker(QThread):
     status = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, modpack: Dict[str, Any], sync_configs: bool):
+    def __init__(self, modpack: Dict[str, Any], sync_configs: bool, keep_cache: bool = False,
+                 memory_budget: int = installer.DEFAULT_MEMORY_BUDGET):
         super().__init__()
         self.modpack = modpack
-        self.sync_configs = sync_configs
+        self.token = engine.CancelToken()
+        self.options = engine.InstallOptions(install_mods=True, sync_configs=sync_configs, keep_cache=keep_cache,
+                                             memory_budget=memory_budget)
 
-    def run(self):
-        try:
-            self.status.emit("Загружаю модлист...")
-            modlist = download_modlist(self.modpack)
-            mods = modlist.get("mods", [])
-            github_zip_url = modlist.get("github_zip_url")
-
-            total = max(1, len(mods))
-            self.status.emit(f"Установка модов ({len(mods)})...")
-            logger.info(f"Начинаю установку {len(mods)} модов...")
-
-            successful = 0
-            for i, mod in enumerate(mods, 1):
-                mod_name = mod.get("name")
-                url = mod.get("url")
-
-                self.progress.emit(int((i - 1) / total * 80))
-                self.status.emit(f"Скачиваю: {mod_name}")
-
-                if not mod_name or not url:
-                    logger.warning(f"Пропущен мод без имени или URL: {mod}")
-                    continue
-
-                # Определяем расширение из URL (поддержка .zip и .7z)
-                ext = Path(urlparse(url).path).suffix.lower() or ".zip"
-                archive_path = DOWNLOADS_DIR / f"{mod_name}{ext}"
-                downloader.download_file(url, archive_path)
-
-                self.status.emit(f"Распаковываю: {mod_name}")
-                installer.extract_archive(archive_path, MODS_DIR / mod_name)
-
-                installer.create_meta_ini(mod_name, MODS_DIR)
-                successful += 1
-                self.progress.emit(int((i) / total * 80))
-
-            logger.success(f"Успешно установлено модов: {successful}")
-
-            if self.sync_configs:
-                self.progress.emit(90)
-                self.status.emit("Синхронизация конфигураций...")
-                if github_zip_url:
-                    gitpack_sync.download_config_zip(github_zip_url, GITHUB_ZIP_PATH)
-                    gitpack_sync.extract_config_zip(GITHUB_ZIP_PATH, GITHUB_EXTRACT_DIR)
-                    gitpack_sync.apply_configs(GITHUB_EXTRACT_DIR, OVERWRITE_DIR, PROFILES_DIR)
-                    logger.success("Конфигурации успешно применены!")
-                else:
-                    logger.warning("GitHub URL для модпака не указан.")
+    def cancel(self):
+        self.token.cancel()
 
+    def set_paused(self, paused: bool):
+        if paused:
+            self.token.pause()
+        else:
+            self.token.resume()
+
+    def _on_event(self, event: engine.InstallEvent):
+        # Моды занимают 0-80% шкалы, конфигурации и очистка - остаток
+        if event.stage == engine.STAGE_MODLIST:
+            self.status.emit("Загружаю модлист...")
+        elif event.stage in STAGE_LABELS and event.mod:
+            total = max(1, event.total)
+            fraction = event.bytes_done / event.bytes_total if event.bytes_total else 0
+            self.progress.emit(int((event.index + fraction) / total * 80))
+            self.status.emit(f"{STAGE_LABELS[event.stage]}: {event.mod}")
+        elif event.stage == engine.STAGE_MOD_DONE:
+            self.progress.emit(int(event.index / max(1, event.total) * 80))
+        elif event.stage == engine.STAGE_CONFIGS:
+            self.progress.emit(90)
+            self.status.emit("Синхронизация конфигураций...")
+        elif event.stage == engine.STAGE_CLEANUP:
             self.progress.emit(95)
             self.status.emit("Очистка кэша...")
-            installer.clean_cache(CACHE_DIR)
 
-            self.progress.emit(100)
-            self.status.emit("Готово")
-            self.finished.emit(True, "Установка завершена успешно!")
+    def run(self):
+        install_engine = engine.InstallEngine(PATHS, self.options, on_event=self._on_event, token=self.token)
+        try:
+            result = install_engine.run(modpack=self.modpack)
         except Exception as e:
             logger.error(f"Ошибка при установке: {e}")
             self.finished.emit(False, f"Ошибка: {e}")
+            return
+
+        if result.cancelled:
+            self.status.emit("Отменено")
+            self.finished.emit(False, "Установка отменена")
+            return
+
+        self.progress.emit(100)
+        self.status.emit("Готово")
+        if result.ok:
+            self.finished.emit(True, "Установка завершена успешно!")
+        else:
+            problems = [f"Не удалось установить: {', '.join(result.failed_mods)}"] if result.failed_mods else []
+            problems += result.errors
+            self.finished.emit(False, "Установка завершена с ошибками.\n" + "\n".join(problems))
 
 
 class ModpackInstallerGUI(QMainWindow):
-    def __init__(self, modpacks, base_dir: Path | str | None = None):
+    def __init__(self, modpacks, base_dir: Path | str | None = None, keep_cache: bool = False,
+                 memory_budget: int = installer.DEFAULT_MEMORY_BUDGET):
         super().__init__()
         self.modpacks = modpacks
         self.base_dir = Path(base_dir) if base_dir else BASE_DIR
+        self.keep_cache = keep_cache
+        self.memory_budget = memory_budget
         self.worker: InstallWorker | None = None
         self._init_ui()
 
@@ -167,6 +148,18 @@ class ModpackInstallerGUI(QMainWindow):
         self.progress.setVisible(False)
         layout.addWidget(self.progress)
 
+        controls = QHBoxLayout()
+        self.btn_pause = QPushButton("Пауза")
+        self.btn_pause.setCheckable(True)
+        self.btn_pause.toggled.connect(self._on_pause_toggled)
+        controls.addWidget(self.btn_pause)
+        self.btn_cancel = QPushButton("Отмена")
+        self.btn_cancel.clicked.connect(self._on_cancel_clicked)
+        controls.addWidget(self.btn_cancel)
+        layout.addLayout(controls)
+        self.btn_pause.setVisible(False)
+        self.btn_cancel.setVisible(False)
+
         self.status_lbl = QLabel("Готов к установке")
         self.status_lbl.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.status_lbl)
@@ -176,8 +169,13 @@ class ModpackInstallerGUI(QMainWindow):
         self.chk_sync.setEnabled(not busy)
         self.btn_install.setEnabled(not busy)
         self.progress.setVisible(busy)
+        self.btn_pause.setVisible(busy)
+        self.btn_cancel.setVisible(busy)
+        self.btn_cancel.setEnabled(busy)
         if busy:
             self.progress.setValue(0)
+        else:
+            self.btn_pause.setChecked(False)
 
     def _on_install_clicked(self):
         items = self.list_widget.selectedItems()
@@ -199,12 +197,34 @@ class ModpackInstallerGUI(QMainWindow):
             return
 
         self._set_busy(True)
-        self.worker = InstallWorker(modpack, self.chk_sync.isChecked())
+        self.worker = InstallWorker(modpack, self.chk_sync.isChecked(), self.keep_cache, self.memory_budget)
         self.worker.progress.connect(self.progress.setValue)
         self.worker.status.connect(self.status_lbl.setText)
         self.worker.finished.connect(self._on_finished)
         self.worker.start()
 
+    def _on_pause_toggled(self, paused: bool):
+        if self.worker:
+            self.worker.set_paused(paused)
+        self.btn_pause.setText("Продолжить" if paused else "Пауза")
+        if paused:
+            self.status_lbl.setText("Пауза")
+
+    def _on_cancel_clicked(self):
+        if self.worker:
+            self.btn_cancel.setEnabled(False)
+            self.status_lbl.setText("Отмена...")
+            self.worker.cancel()
+
+    def closeEvent(self, event):
+        # Нельзя уничтожать работающий QThread: отменяем установку и ждём, пока поток завершится
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.finished.disconnect(self._on_finished)
+            self.status_lbl.setText("Отмена...")
+            self.worker.cancel()
+            self.worker.wait()
+        super().closeEvent(event)
+
     def _on_finished(self, success: bool, msg: str):
         self._set_busy(False)
         if success:
@@ -213,8 +233,9 @@ class ModpackInstallerGUI(QMainWindow):
             QMessageBox.critical(self, "Ошибка", msg)
 
 
-def launch_gui(modpacks, base_dir: Path | str):
+def launch_gui(modpacks, base_dir: Path | str, keep_cache: bool = False,
+               memory_budget: int = installer.DEFAULT_MEMORY_BUDGET):
     app = QApplication(sys.argv)
-    window = ModpackInstallerGUI(modpacks, base_dir)
+    window = ModpackInstallerGUI(modpacks, base_dir, keep_cache, memory_budget)
     window.show()
     sys.exit(app.exec())
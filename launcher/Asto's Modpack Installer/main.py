@@ -1,16 +1,16 @@
-import json
 import argparse
+import json
+import os
+import signal
 import sys
 from pathlib import Path
-from urllib.parse import urlparse
-from utils import downloader, installer, logger, gitpack_sync
+from utils import downloader, installer, logger, mod_index, filelock, bundle, lan_cache, engine, modlist_cache
 
 def load_config():
     """Загружает конфигурацию с доступными модпаками"""
     config_path = BASE_DIR / "config.json"
     try:
-        with open(config_path, "r", encoding="utf-8") as file:
-            return json.load(file)
+        return modlist_cache.load_config(config_path, PATHS.modlist_cache_dir)
     except Exception as e:
         logger.error(f"Ошибка при чтении конфигурации: {e}")
         exit(1)
@@ -65,118 +65,196 @@ def get_user_preferences():
 
 def download_modlist(modpack):
     """Скачивает модлист для выбранного модпака"""
-    modlist_url = modpack.get("modlist_url")
-    if not modlist_url:
-        logger.error(f"URL модлиста не указан для модпака: {modpack['name']}")
-        exit(1)
-    
-    modlist_path = DOWNLOADS_DIR / f"{modpack['slug']}_modlist.json"
-    
-    logger.info(f"Скачиваю модлист для {modpack['name']}...")
     try:
-        downloader.download_file(modlist_url, modlist_path)
-        with open(modlist_path, "r", encoding="utf-8") as file:
-            return json.load(file)
+        return engine.InstallEngine(PATHS).download_modlist(modpack)
     except Exception as e:
         logger.error(f"Ошибка при скачивании или чтении модлиста: {e}")
         exit(1)
 
-def install_mods(mods):
-    """Устанавливает моды из списка"""
-    logger.info(f"Начинаю установку {len(mods)} модов...")
-    
-    successful_installs = 0
-    failed_installs = 0
-    
-    for i, mod in enumerate(mods, 1):
-        mod_name = mod.get("name")
-        url = mod.get("url")
+# Подписи этапов движка для прогресс-бара
+STAGE_LABELS = {
+    engine.STAGE_PREPARE: "Подготовка",
+    engine.STAGE_DOWNLOAD: "Скачиваю",
+    engine.STAGE_EXTRACT: "Распаковываю",
+    engine.STAGE_META: "Создаю meta.ini",
+}
+RESULT_MARKS = {
+    engine.RESULT_OK: "✓",
+    engine.RESULT_SKIPPED: "=",
+    engine.RESULT_FAILED: "✗",
+}
 
-        # Показываем прогресс
-        logger.progress(i - 1, len(mods), f"Подготовка: {mod_name}")
+def print_event(event):
+    """Отображает события движка установки в консоли"""
+    if event.stage in STAGE_LABELS and event.mod:
+        text = f"{STAGE_LABELS[event.stage]}: {event.mod}"
+        if event.bytes_total:
+            text += f" ({event.bytes_done / 2**20:.1f}/{event.bytes_total / 2**20:.1f} МБ)"
+        logger.progress(event.index, event.total, text)
+    elif event.stage == engine.STAGE_MOD_DONE:
+        text = f"{RESULT_MARKS[event.result]} {event.mod}"
+        if event.result == engine.RESULT_SKIPPED and event.message:
+            text += f" {event.message}"
+        logger.progress(event.index, event.total, text)
 
-        if not mod_name or not url:
-            logger.warning(f"Пропущен мод без имени или URL: {mod}")
-            failed_installs += 1
-            continue
+def run_install(options, modpack=None, source_bundle=None):
+    """Запускает движок установки; первое Ctrl+C отменяет установку кооперативно, второе - прерывает сразу"""
+    token = engine.CancelToken()
+    install_engine = engine.InstallEngine(PATHS, options, on_event=print_event, token=token)
 
-        # Определяем расширение из URL (поддержка .zip и .7z)
-        ext = Path(urlparse(url).path).suffix.lower() or ".zip"
-        archive_path = DOWNLOADS_DIR / f"{mod_name}{ext}"
+    def on_sigint(signum, frame):
+        # Следующее Ctrl+C снова бросит KeyboardInterrupt - на случай операции, которую отмена не прерывает
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        print()
+        logger.warning("Отменяю установку... Нажмите Ctrl+C ещё раз, чтобы прервать немедленно.")
+        token.cancel()
 
-        try:
-            logger.progress(i - 1, len(mods), f"Скачиваю: {mod_name}")
-            downloader.download_file(url, archive_path)
+    previous_handler = signal.signal(signal.SIGINT, on_sigint)
+    try:
+        result = install_engine.run(modpack=modpack, source_bundle=source_bundle)
+    except KeyboardInterrupt:
+        print()
+        logger.warning("Установка прервана.")
+        exit(1)
+    except Exception as e:
+        logger.error(f"Ошибка при установке: {e}")
+        exit(1)
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+
+    if result.cancelled:
+        print()
+        exit(1)
+    logger.success("Процесс установки завершен!")
+
+def show_status():
+    """Показывает установленные моды по индексу"""
+    with filelock.named_lock(PATHS.locks_dir, "mod_index"):
+        index = mod_index.ModIndex(PATHS.mods_dir, PATHS.mod_index_path)
+        rescanned, removed = index.refresh()
+    logger.debug(f"Индекс модов: пересканировано {rescanned}, удалено {removed}")
+    mod_index.print_status(index)
+
+# Конфигурация путей
+BASE_DIR = Path(__file__).resolve().parent
+PATHS = engine.InstallPaths(BASE_DIR)
+
+# Инициализация директорий
+PATHS.ensure()
 
-            logger.progress(i - 1, len(mods), f"Распаковываю: {mod_name}")
-            installer.extract_archive(archive_path, MODS_DIR / mod_name)
+def run_cli(modpacks, keep_cache=False, memory_budget=installer.DEFAULT_MEMORY_BUDGET):
+    """Интерактивная установка в консоли"""
+    selected_modpack = select_modpack(modpacks)
+    install_mods_enabled, sync_configs_enabled = get_user_preferences()
+    options = engine.InstallOptions(install_mods_enabled, sync_configs_enabled, keep_cache, memory_budget=memory_budget)
+    run_install(options, modpack=selected_modpack)
 
-            logger.progress(i - 1, len(mods), f"Создаю meta.ini: {mod_name}")
-            installer.create_meta_ini(mod_name, MODS_DIR)
-            
-            successful_installs += 1
-            logger.progress(i, len(mods), f"✓ {mod_name}")
+def run_export_bundle(modpacks, bundle_path, keep_cache=False):
+    """Собирает офлайн-бандл выбранного модпака"""
+    selected_modpack = select_modpack(modpacks)
+    with filelock.CacheSession(PATHS.locks_dir):
+        modlist = download_modlist(selected_modpack)
+        try:
+            bundle.export_bundle(modlist, bundle_path, PATHS.downloads_dir, PATHS.github_zip_path)
         except Exception as e:
-            logger.error(f"Ошибка при установке мода {mod_name}: {e}")
-            failed_installs += 1
-            logger.progress(i, len(mods), f"✗ {mod_name}")
-            continue
-
-    # Финальная статистика
-    if successful_installs > 0:
-        logger.success(f"Успешно установлено модов: {successful_installs}")
-    if failed_installs > 0:
-        logger.warning(f"Не удалось установить модов: {failed_installs}")
-    
-    logger.info("Установка модов завершена.")
+            logger.error(f"Ошибка при создании бандла: {e}")
+            sys.exit(1)
+        finally:
+            engine.InstallEngine(PATHS, engine.InstallOptions(keep_cache=keep_cache)).clean_cache()
 
-def sync_github_configs(github_zip_url):
-    """Синхронизирует конфигурации с GitHub"""
-    if not github_zip_url:
-        logger.warning("GitHub URL для модпака не указан.")
-        return
-    
+def run_pin_hashes(modlist_path, keep_cache=False):
+    """Скачивает архивы модлиста и записывает их sha256 в модлист (нужно для загрузки у LAN-пиров)"""
+    modlist_path = Path(modlist_path)
     try:
-        logger.info(f"Загружаю архив конфигураций с GitHub...")
-        gitpack_sync.download_config_zip(github_zip_url, GITHUB_ZIP_PATH)
+        data = modlist_cache.loads(modlist_path.read_bytes())
+        modlist = modlist_cache.compile_modlist(data, modlist_path.name)
+    except Exception as e:
+        logger.error(f"Не удалось прочитать модлист {modlist_path}: {e}")
+        sys.exit(1)
 
-        logger.info("Распаковываю архив конфигураций...")
-        gitpack_sync.extract_config_zip(GITHUB_ZIP_PATH, GITHUB_EXTRACT_DIR)
+    pinned = 0
+    total = len(modlist.mods)
+    with filelock.CacheSession(PATHS.locks_dir):
+        try:
+            # Модлист прошёл проверку целиком, поэтому записи идут один к одному
+            for i, (raw, mod) in enumerate(zip(data["mods"], modlist.mods), 1):
+                logger.progress(i - 1, total, f"Хэширую: {mod.name}")
+                archive_path = engine.archive_path_for(PATHS.downloads_dir, mod.name, mod.url)
+                downloader.download_file(mod.url, archive_path, reuse=True, sha256=mod.sha256)
+                digest = lan_cache.cached_sha256(archive_path)
+                if raw.get("sha256") != digest:
+                    raw["sha256"] = digest
+                    pinned += 1
+                logger.progress(i, total, f"✓ {mod.name}")
+        except Exception as e:
+            logger.error(f"Ошибка при получении хэшей: {e}")
+            sys.exit(1)
+        finally:
+            engine.InstallEngine(PATHS, engine.InstallOptions(keep_cache=keep_cache)).clean_cache()
 
-        logger.info("Применяю конфигурации модпака...")
-        gitpack_sync.apply_configs(GITHUB_EXTRACT_DIR, OVERWRITE_DIR, PROFILES_DIR)
+    tmp_path = modlist_path.with_name(f"{modlist_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+        file.write("\n")
+    os.replace(tmp_path, modlist_path)
+    logger.success(f"sha256 записаны в {modlist_path} (обновлено модов: {pinned} из {total})")
 
-        logger.success("Конфигурации успешно применены!")
+def run_from_bundle(bundle_path, keep_cache=False, memory_budget=installer.DEFAULT_MEMORY_BUDGET):
+    """Устанавливает модпак из офлайн-бандла без обращения к сети"""
+    try:
+        source_bundle = bundle.Bundle(bundle_path)
     except Exception as e:
-        logger.error(f"Ошибка при применении пакета с GitHub: {e}")
-
-# Конфигурация путей
-BASE_DIR = Path(__file__).resolve().parent
-LAUNCHER_DIR = BASE_DIR.parent  # Корневая папка launcher
-DOWNLOADS_DIR = BASE_DIR / ".cache" / "downloads"
-GITHUB_ZIP_PATH = BASE_DIR / ".cache" / "github_config.zip"
-GITHUB_EXTRACT_DIR = BASE_DIR / ".cache" / "github_config"
-MODS_DIR = LAUNCHER_DIR / "mods"
-CACHE_DIR = BASE_DIR / ".cache"
-OVERWRITE_DIR = LAUNCHER_DIR / "overwrite"
-PROFILES_DIR = LAUNCHER_DIR / "profiles"
+        logger.error(f"Не удалось открыть бандл {bundle_path}: {e}")
+        sys.exit(1)
 
-# Инициализация директорий
-for path in [DOWNLOADS_DIR, GITHUB_EXTRACT_DIR, MODS_DIR]:
-    path.mkdir(parents=True, exist_ok=True)
+    with source_bundle:
+        logger.info(f"Модпак из бандла: {source_bundle.modlist.name or bundle_path}")
+        install_mods_enabled, sync_configs_enabled = get_user_preferences()
+        options = engine.InstallOptions(install_mods_enabled, sync_configs_enabled, keep_cache, memory_budget=memory_budget)
+        run_install(options, source_bundle=source_bundle)
 
 def main():
     """Основная функция программы"""
     parser = argparse.ArgumentParser(description="Asto's Modpack Installer")
     parser.add_argument("--gui", action="store_true", help="Запустить графический интерфейс (PyQt6)")
+    parser.add_argument("--status", action="store_true", help="Показать установленные моды и отсутствующие зависимости")
+    parser.add_argument("--export-bundle", metavar="PATH", type=Path, help="Собрать офлайн-бандл модпака (модлист, архивы, конфиги) в файл")
+    parser.add_argument("--from-bundle", metavar="PATH", type=Path, help="Установить модпак из офлайн-бандла без сети")
+    parser.add_argument("--serve", metavar="PORT", type=int, nargs="?", const=lan_cache.DEFAULT_PORT, help="Раздавать кэш архивов по локальной сети")
+    parser.add_argument("--peers", metavar="URL[,URL...]", help="LAN-кэши других машин, опрашиваемые перед исходными ссылками (только для модов с sha256 в модлисте)")
+    parser.add_argument("--pin-hashes", metavar="MODLIST", type=Path, help="Скачать архивы модлиста и записать их sha256 в файл модлиста")
+    parser.add_argument("--keep-cache", action="store_true", help="Не удалять скачанные архивы после установки")
+    parser.add_argument("--memory-budget", metavar="MB", type=int, default=installer.DEFAULT_MEMORY_BUDGET // 2**20, help="Предел памяти декодера .7z, МБ: архивы с большим словарём распаковываются системным 7z")
     args = parser.parse_args()
+    memory_budget = max(1, args.memory_budget) * 2**20
 
     logger.header("Asto's Modpack Installer")
 
+    if args.serve is not None:
+        # Открытая сессия не даёт параллельным установкам очистить раздаваемый кэш
+        with filelock.CacheSession(PATHS.locks_dir):
+            lan_cache.serve(PATHS.downloads_dir, port=args.serve)
+        return
+
+    if args.status:
+        show_status()
+        return
+
+    if args.pin_hashes:
+        run_pin_hashes(args.pin_hashes, args.keep_cache)
+        return
+
+    if args.from_bundle:
+        run_from_bundle(args.from_bundle, args.keep_cache, memory_budget)
+        return
+
     # Загрузка конфигурации
     config = load_config()
     modpacks = config.get("modpacks", [])
 
+    peers = args.peers.split(",") if args.peers else config.get("lan_peers", [])
+    downloader.set_lan_peers([p.strip() for p in peers])
+
     if args.gui:
         try:
             from gui import launch_gui
@@ -184,28 +262,15 @@ def main():
             logger.error(f"Не удалось загрузить GUI: {e}. Убедитесь, что установлен PyQt6 и файл gui.py присутствует.")
             sys.exit(1)
         # Запуск GUI и выход после закрытия окна
-        launch_gui(modpacks, BASE_DIR)
+        launch_gui(modpacks, BASE_DIR, args.keep_cache, memory_budget)
         return
 
-    # CLI режим (по умолчанию)
-    selected_modpack = select_modpack(modpacks)
-    install_mods_enabled, sync_configs_enabled = get_user_preferences()
-    modlist = download_modlist(selected_modpack)
-    mods = modlist.get("mods", [])
-    github_zip_url = modlist.get("github_zip_url")
-
-    if install_mods_enabled:
-        install_mods(mods)
-    else:
-        logger.info("Установка модов пропущена по выбору пользователя.")
-
-    if sync_configs_enabled:
-        sync_github_configs(github_zip_url)
-    else:
-        logger.info("Синхронизация конфигураций пропущена по выбору пользователя.")
+    if args.export_bundle:
+        run_export_bundle(modpacks, args.export_bundle, args.keep_cache)
+        return
 
-    installer.clean_cache(CACHE_DIR)
-    logger.success("Процесс установки завершен!")
+    # CLI режим (по умолчанию)
+    run_cli(modpacks, args.keep_cache, memory_budget)
 
 if __name__ == "__main__":
     main()
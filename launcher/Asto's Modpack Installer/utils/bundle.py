@@ -0,0 +1,221 @@
+"""
+Офлайн-бандл модпака: один файл с модлистом, архивами модов и архивом конфигураций.
+
+Формат:
+    заголовок (28 байт): MAGIC, версия формата (u32), смещение и длина индекса (u64, u64)
+    данные: архивы подряд, без сжатия (они и так сжаты)
+    индекс: JSON с модлистом и таблицей {ключ: name, offset, size, sha256}
+"""
+import io
+import errno
+import os
+import json
+import mmap
+import struct
+import hashlib
+import weakref
+from pathlib import Path
+from typing import Dict, Any, Optional
+from urllib.parse import urlparse
+from utils import logger, downloader, modlist_cache
+from utils.modlist_cache import CompiledModlist
+
+MAGIC = b"ASTOBNDL"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sIQQ")
+COPY_CHUNK_SIZE = 1024 * 1024
+CONFIG_KEY = "config"
+_ENTRY_FIELDS = {"name", "offset", "size", "sha256"}
+
+
+def mod_key(mod_name: str) -> str:
+    return f"mod:{mod_name}"
+
+
+def archive_name(mod_name: str, url: str) -> str:
+    """Имя архива мода так же, как его называет установщик при скачивании."""
+    ext = Path(urlparse(url).path).suffix.lower() or ".zip"
+    return f"{mod_name}{ext}"
+
+
+class BundleError(Exception):
+    """Бандл повреждён или не соответствует формату."""
+
+
+class _MemberReader(io.RawIOBase):
+    """Файловый объект только для чтения поверх участка memory map (без копирования в память)."""
+
+    def __init__(self, view: memoryview):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = max(0, min(len(buffer), len(self._view) - self._pos))
+        buffer[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Некорректный whence: {whence}")
+        if pos < 0:
+            raise OSError(errno.EINVAL, "Отрицательная позиция")  # Как у обычного файла: zipfile ловит OSError
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class Bundle:
+    """Открытый на чтение бандл. Данные читаются через mmap и проверяются по sha256."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise BundleError(f"Пустой файл бандла: {self.path}")
+        self._verified = set()
+        self._readers = weakref.WeakSet()  # Открытые элементы: их view нужно освободить до закрытия mmap
+        try:
+            self._index = self._read_index()
+            self.entries: Dict[str, Dict[str, Any]] = self._index["entries"]
+            self.modlist: CompiledModlist = modlist_cache.compile_modlist(self._index["modlist"], self.path.name)
+        except Exception:
+            self.close()
+            raise
+
+    def _read_index(self) -> Dict[str, Any]:
+        if len(self._mm) < _HEADER.size:
+            raise BundleError(f"Файл слишком мал для бандла: {self.path}")
+        magic, version, index_offset, index_size = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise BundleError(f"Файл не является бандлом модпака: {self.path}")
+        if version != FORMAT_VERSION:
+            raise BundleError(f"Неподдерживаемая версия бандла: {version}")
+        if index_offset + index_size > len(self._mm):
+            raise BundleError("Индекс бандла выходит за пределы файла")
+        try:
+            index = modlist_cache.loads(self._mm[index_offset:index_offset + index_size])
+        except ValueError as e:
+            raise BundleError(f"Индекс бандла не читается: {e}")
+        entries = index.get("entries") if isinstance(index, dict) else None
+        if not isinstance(entries, dict) or "modlist" not in index or not all(
+                isinstance(entry, dict) and _ENTRY_FIELDS.issubset(entry) for entry in entries.values()):
+            raise BundleError(f"Индекс бандла повреждён: {self.path}")
+        return index
+
+    def has(self, key: str) -> bool:
+        return key in self.entries
+
+    def member_name(self, key: str) -> str:
+        return self.entries[key]["name"]
+
+    def open(self, key: str) -> _MemberReader:
+        """Открывает элемент бандла; при первом обращении сверяет sha256."""
+        entry = self.entries[key]
+        offset, size = entry["offset"], entry["size"]
+        if offset + size > len(self._mm):
+            raise BundleError(f"Элемент {entry['name']} выходит за пределы бандла")
+        view = memoryview(self._mm)[offset:offset + size]
+        if key not in self._verified:
+            if hashlib.sha256(view).hexdigest() != entry["sha256"]:
+                view.release()
+                raise BundleError(f"Контрольная сумма не совпадает: {entry['name']}")
+            self._verified.add(key)
+        reader = _MemberReader(view)
+        self._readers.add(reader)
+        return reader
+
+    def close(self):
+        """Закрывает бандл; незакрытые элементы закрываются вместе с ним."""
+        for reader in list(getattr(self, "_readers", ())):
+            reader.close()
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _append_file(out, source_path: Path) -> Dict[str, Any]:
+    """Дописывает файл в бандл, считая sha256 на лету."""
+    digest = hashlib.sha256()
+    offset = out.tell()
+    with open(source_path, "rb") as src:
+        while True:
+            chunk = src.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return {"name": source_path.name, "offset": offset, "size": out.tell() - offset, "sha256": digest.hexdigest()}
+
+
+def export_bundle(modlist: CompiledModlist, bundle_path: Path, downloads_dir: Path, config_zip_path: Optional[Path] = None):
+    """
+    Скачивает все архивы модлиста (и архив конфигураций) и упаковывает их вместе
+    с модлистом в один файл бандла. Бандл пишется атомарно.
+    """
+    bundle_path = Path(bundle_path)
+    downloads_dir = Path(downloads_dir)
+    mods = modlist.mods
+    entries: Dict[str, Dict[str, Any]] = {}
+
+    tmp_path = bundle_path.with_name(f"{bundle_path.name}.{os.getpid()}.part")
+    try:
+        with open(tmp_path, "wb") as out:
+            out.write(b"\0" * _HEADER.size)
+
+            for i, mod in enumerate(mods, 1):
+                mod_name, url = mod.name, mod.url
+                logger.progress(i - 1, len(mods), f"Упаковываю: {mod_name}")
+                archive_path = downloads_dir / archive_name(mod_name, url)
+                downloader.download_file(url, archive_path, reuse=True, sha256=mod.sha256)
+                entries[mod_key(mod_name)] = _append_file(out, archive_path)
+                logger.progress(i, len(mods), f"✓ {mod_name}")
+
+            github_zip_url = modlist.github_zip_url
+            if github_zip_url and config_zip_path is not None:
+                logger.info("Упаковываю архив конфигураций...")
+                downloader.download_file(github_zip_url, config_zip_path)
+                entries[CONFIG_KEY] = _append_file(out, Path(config_zip_path))
+
+            index = json.dumps({"modlist": modlist.to_dict(), "entries": entries}, ensure_ascii=False).encode("utf-8")
+            index_offset = out.tell()
+            out.write(index)
+            out.seek(0)
+            out.write(_HEADER.pack(MAGIC, FORMAT_VERSION, index_offset, len(index)))
+        os.replace(tmp_path, bundle_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    size_mb = bundle_path.stat().st_size / (1024 * 1024)
+    logger.success(f"Бандл сохранён: {bundle_path} ({len(entries)} архивов, {size_mb:.1f} МБ)")
@@ -1,11 +1,96 @@
+import os
+import hashlib
 import requests
 from pathlib import Path
-from utils import logger
-
-def download_file(url: str, dest_path: Path):
-    """Скачивает файл по URL и сохраняет его в dest_path."""
-    response = requests.get(url)
-    response.raise_for_status()
-    with open(dest_path, "wb") as file:
-        file.write(response.content)
+from typing import Callable, List, Optional
+from utils import logger, filelock, lan_cache
+
+CHUNK_SIZE = 64 * 1024  # Небольшой чанк, чтобы отмена/пауза срабатывали быстро
+ORIGIN_TIMEOUT = (10, 30)  # (подключение, чтение) - зависшее соединение не должно блокировать отмену навсегда
+
+# LAN-пиры, у которых архивы ищутся до обращения к исходному URL
+_lan_peers = lan_cache.PeerSet([])
+
+def set_lan_peers(peers: List[str]):
+    """Задаёт список LAN-кэшей (http://host:port), опрашиваемых перед исходным URL."""
+    global _lan_peers
+    _lan_peers = lan_cache.PeerSet(peers)
+    if _lan_peers.peers:
+        logger.info(f"LAN-кэши: {', '.join(_lan_peers.peers)}")
+
+def _read_marker(marker_path: Path):
+    try:
+        return marker_path.read_text(encoding="utf-8")
+    except OSError:
+        return None
+
+def _download_from_origin(url: str, tmp_path: Path, progress=None, on_cancel=None) -> str:
+    digest = hashlib.sha256()
+    with requests.get(url, stream=True, timeout=ORIGIN_TIMEOUT) as response, \
+            lan_cache.abort_on_cancel(response, on_cancel):
+        response.raise_for_status()
+        total = int(response.headers.get("Content-Length") or 0)
+        done = 0
+        with open(tmp_path, "wb") as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                digest.update(chunk)
+                file.write(chunk)
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, total)
+    return digest.hexdigest()
+
+def download_file(url: str, dest_path: Path, reuse: bool = False, sha256: Optional[str] = None,
+                  progress: Optional[Callable[[int, int], None]] = None,
+                  cancel_check: Optional[Callable[[], None]] = None,
+                  on_cancel: Optional[Callable[[Callable[[], None]], Callable[[], None]]] = None):
+    """
+    Скачивает файл по URL и сохраняет его в dest_path.
+
+    Загрузка выполняется под межпроцессной блокировкой файла: если другой процесс
+    уже качает тот же файл, ждём его и используем результат (single-flight).
+    При reuse=True готовый файл с тем же URL используется и без ожидания.
+    Если заданы LAN-пиры и модлист указывает sha256, файл сначала ищется у них;
+    без sha256 файл качается только по исходному URL. sha256 (если известен) проверяется
+    для любого источника.
+    progress(скачано, всего) вызывается на каждом чанке; исключение из него прерывает
+    загрузку (так работает отмена), недокачанный файл удаляется. cancel_check вызывается,
+    пока ждём блокировку файла, занятую другим процессом, и после оборванной загрузки.
+    on_cancel(колбэк) -> снять_регистрацию (см. engine.CancelToken.on_cancel) позволяет
+    отмене оборвать соединение сразу, даже если сервер завис; без него зависшее
+    соединение прерывается по таймауту чтения ORIGIN_TIMEOUT.
+    """
+    dest_path = Path(dest_path)
+    marker_path = dest_path.with_name(dest_path.name + lan_cache.URL_SUFFIX)
+    sha256_path = dest_path.with_name(dest_path.name + lan_cache.SHA256_SUFFIX)
+    sha256 = sha256.lower() if sha256 else None
+
+    with filelock.sidecar_lock(dest_path, cancel_check=cancel_check) as lock:
+        if (reuse or lock.contended) and dest_path.exists() and _read_marker(marker_path) == url:
+            if sha256 is None or lan_cache.cached_sha256(dest_path) == sha256:
+                logger.log(f"Взят из кэша: {dest_path.name}")
+                return
+
+        # Пишем во временный файл и атомарно подменяем, чтобы никто не увидел недокачанный архив
+        tmp_path = dest_path.with_name(f"{dest_path.name}.{os.getpid()}.part")
+        try:
+            digest = _lan_peers.fetch(requests, url, tmp_path, sha256, progress, on_cancel) if _lan_peers.peers else None
+            if digest is None:
+                if cancel_check is not None:
+                    cancel_check()  # Загрузку у пира могла оборвать отмена - не идём к исходному URL
+                try:
+                    digest = _download_from_origin(url, tmp_path, progress, on_cancel)
+                except OSError:
+                    # Соединение, оборванное отменой, выглядит как сетевая ошибка - сообщаем об отмене
+                    if cancel_check is not None:
+                        cancel_check()
+                    raise
+                if sha256 and digest != sha256:
+                    raise ValueError(f"Контрольная сумма {dest_path.name} не совпадает с модлистом")
+            marker_path.unlink(missing_ok=True)
+            os.replace(tmp_path, dest_path)
+            sha256_path.write_text(digest, encoding="utf-8")
+            marker_path.write_text(url, encoding="utf-8")
+        finally:
+            tmp_path.unlink(missing_ok=True)
     logger.log(f"Скачан: {dest_path.name}")
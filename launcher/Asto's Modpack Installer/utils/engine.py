@@ -0,0 +1,425 @@
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable, List, Union
+from urllib.parse import urlparse
+from utils import downloader, installer, logger, gitpack_sync, mod_index, filelock, bundle, modlist_cache
+from utils.modlist_cache import CompiledModlist, ModRecord
+
+# Этапы установки, которые получают фронтенды (CLI и GUI)
+STAGE_MODLIST = "modlist"
+STAGE_PREPARE = "prepare"
+STAGE_DOWNLOAD = "download"
+STAGE_EXTRACT = "extract"
+STAGE_META = "meta"
+STAGE_MOD_DONE = "mod_done"
+STAGE_CONFIGS = "configs"
+STAGE_CLEANUP = "cleanup"
+STAGE_DONE = "done"
+
+RESULT_OK = "ok"
+RESULT_SKIPPED = "skipped"
+RESULT_FAILED = "failed"
+RESULT_CANCELLED = "cancelled"
+
+
+class InstallCancelled(Exception):
+    """Установка отменена пользователем."""
+
+
+class InstallPaths:
+    """Пути установщика относительно его папки (BASE_DIR)."""
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = Path(base_dir)
+        self.launcher_dir = self.base_dir.parent  # Корневая папка launcher
+        self.cache_dir = self.base_dir / ".cache"
+        self.downloads_dir = self.cache_dir / "downloads"
+        self.github_zip_path = self.cache_dir / "github_config.zip"
+        self.github_extract_dir = self.cache_dir / "github_config"
+        self.mods_dir = self.launcher_dir / "mods"
+        self.overwrite_dir = self.launcher_dir / "overwrite"
+        self.profiles_dir = self.launcher_dir / "profiles"
+        self.mod_index_path = self.base_dir / "mods_index.json"  # Вне .cache, чтобы переживать clean_cache
+        self.locks_dir = self.base_dir / ".locks"  # Межпроцессные блокировки общего кэша
+        self.modlist_cache_dir = self.base_dir / ".modlist_cache"  # Скомпилированные модлисты по хэшу
+
+    def ensure(self):
+        """Создаёт рабочие директории."""
+        for path in [self.downloads_dir, self.github_extract_dir, self.mods_dir]:
+            path.mkdir(parents=True, exist_ok=True)
+
+
+class InstallOptions:
+    """Настройки одного запуска установки."""
+
+    def __init__(self, install_mods: bool = True, sync_configs: bool = True,
+                 keep_cache: bool = False, stop_on_error: bool = False,
+                 memory_budget: int = installer.DEFAULT_MEMORY_BUDGET):
+        self.install_mods = install_mods
+        self.sync_configs = sync_configs
+        self.keep_cache = keep_cache
+        self.stop_on_error = stop_on_error
+        self.memory_budget = memory_budget  # Предел памяти декодера .7z, см. installer.extract_archive
+
+
+class InstallEvent:
+    """Структурированное событие установки: этап, мод, байты, результат."""
+
+    def __init__(self, stage: str, mod: Optional[str] = None, index: int = 0, total: int = 0,
+                 bytes_done: int = 0, bytes_total: int = 0, result: Optional[str] = None, message: str = ""):
+        self.stage = stage
+        self.mod = mod
+        self.index = index
+        self.total = total
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.result = result
+        self.message = message
+
+    def __repr__(self):
+        return f"InstallEvent({self.stage!r}, mod={self.mod!r}, {self.index}/{self.total}, result={self.result!r})"
+
+
+class InstallResult:
+    """Итог установки."""
+
+    def __init__(self):
+        self.successful = 0
+        self.skipped = 0
+        self.failed = 0
+        self.failed_mods: List[str] = []
+        self.errors: List[str] = []
+        self.cancelled = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.cancelled and self.failed == 0 and not self.errors
+
+
+class CancelToken:
+    """
+    Кооперативная отмена и пауза. Движок вызывает check() между шагами, на каждом
+    чанке загрузки и распаковки ZIP и при ожидании блокировок других процессов,
+    поэтому отмена обычно срабатывает почти сразу.
+
+    Активные загрузки регистрируются через on_cancel(): отмена сразу обрывает их
+    соединение, даже если сервер перестал присылать данные.
+
+    Не прерываются посреди работы: распаковка .7z через py7zr (extractall), распаковка
+    и применение архива конфигураций; отмена сработает после их завершения.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        # RLock: cancel() вызывается и из обработчика SIGINT в том же потоке
+        self._lock = threading.RLock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        self._running.set()  # Разбудить поток, стоящий на паузе
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"Ошибка при прерывании операции: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Регистрирует callback, вызываемый при отмене (сразу, если отмена уже была).
+        Возвращает функцию, снимающую регистрацию.
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    def check(self):
+        """Ждёт снятия паузы и бросает InstallCancelled, если установка отменена."""
+        self._running.wait()
+        if self._cancelled.is_set():
+            raise InstallCancelled()
+
+
+def archive_path_for(downloads_dir: Path, mod_name: str, url: str) -> Path:
+    # Определяем расширение из URL (поддержка .zip и .7z)
+    ext = Path(urlparse(url).path).suffix.lower() or ".zip"
+    return downloads_dir / f"{mod_name}{ext}"
+
+
+class InstallEngine:
+    """Общий движок установки модпака для CLI и GUI."""
+
+    def __init__(self, paths: InstallPaths, options: Optional[InstallOptions] = None,
+                 on_event: Optional[Callable[[InstallEvent], None]] = None,
+                 token: Optional[CancelToken] = None):
+        self.paths = paths
+        self.options = options or InstallOptions()
+        self.on_event = on_event
+        self.token = token or CancelToken()
+
+    def _emit(self, stage: str, **kwargs):
+        if self.on_event is not None:
+            self.on_event(InstallEvent(stage, **kwargs))
+
+    def download_modlist(self, modpack: Dict[str, Any]) -> CompiledModlist:
+        """Скачивает модлист для выбранного модпака и проверяет его до начала установки."""
+        modlist_url = modpack.get("modlist_url")
+        if not modlist_url:
+            raise RuntimeError(f"URL модлиста не указан для модпака: {modpack['name']}")
+
+        modlist_path = self.paths.downloads_dir / f"{modpack['slug']}_modlist.json"
+
+        logger.info(f"Скачиваю модлист для {modpack['name']}...")
+        self._emit(STAGE_MODLIST, message=modpack["name"])
+        downloader.download_file(modlist_url, modlist_path, progress=self._transfer_progress(STAGE_MODLIST),
+                                 cancel_check=self.token.check, on_cancel=self.token.on_cancel)
+        return modlist_cache.load_modlist(modlist_path, self.paths.modlist_cache_dir)
+
+    def run(self, modpack: Optional[Dict[str, Any]] = None,
+            modlist: Union[CompiledModlist, Dict[str, Any], None] = None,
+            source_bundle: Optional[bundle.Bundle] = None) -> InstallResult:
+        """
+        Выполняет установку: модлист -> моды -> конфигурации -> очистка кэша.
+        Ошибка загрузки модлиста пробрасывается; ошибки отдельных модов и конфигураций
+        попадают в InstallResult (или прерывают установку при stop_on_error).
+        Нехватка места на диске прерывает установку сразу.
+        """
+        result = InstallResult()
+        try:
+            with filelock.CacheSession(self.paths.locks_dir):
+                if modlist is None:
+                    modlist = source_bundle.modlist if source_bundle is not None else self.download_modlist(modpack)
+                elif isinstance(modlist, dict):
+                    modlist = modlist_cache.compile_modlist(modlist)
+
+                try:
+                    if self.options.install_mods:
+                        if source_bundle is not None:
+                            self._preflight_bundle(modlist.mods, source_bundle)
+                        self.install_mods(modlist.mods, result, source_bundle)
+                    else:
+                        logger.info("Установка модов пропущена по выбору пользователя.")
+
+                    if self.options.sync_configs:
+                        self.sync_configs(modlist.github_zip_url, result, source_bundle)
+                    else:
+                        logger.info("Синхронизация конфигураций пропущена по выбору пользователя.")
+                except installer.DiskSpaceError as e:
+                    # Места не хватит и следующим модам - останавливаемся, пока диск не заполнен
+                    logger.error(f"Установка прервана: {e}")
+                    result.errors.append(str(e))
+
+                self.clean_cache()
+        except InstallCancelled:
+            result.cancelled = True
+            logger.warning("Установка отменена пользователем.")
+
+        self._emit(STAGE_DONE, result=RESULT_CANCELLED if result.cancelled else (RESULT_OK if result.ok else RESULT_FAILED))
+        return result
+
+    def _transfer_progress(self, stage: str, mod: Optional[str] = None, index: int = 0, total: int = 0):
+        """Колбэк для загрузчика: проверяет отмену/паузу на каждом чанке и сообщает байты."""
+        def progress(bytes_done: int, bytes_total: int):
+            self.token.check()
+            self._emit(stage, mod=mod, index=index, total=total, bytes_done=bytes_done, bytes_total=bytes_total)
+        return progress
+
+    def install_mods(self, mods: List[ModRecord], result: InstallResult,
+                     source_bundle: Optional[bundle.Bundle] = None):
+        """Устанавливает моды из списка (из интернета или из офлайн-бандла)."""
+        logger.info(f"Начинаю установку {len(mods)} модов...")
+
+        index = self._refresh_index()
+        total = len(mods)
+
+        for i, mod in enumerate(mods, 1):
+            self.token.check()
+            mod_name = mod.name
+            self._emit(STAGE_PREPARE, mod=mod_name, index=i - 1, total=total)
+
+            # Если в модлисте указан UniqueID и версия уже установлена - не скачиваем повторно
+            installed = index.get(mod.unique_id) if mod.unique_id else None
+            if installed and mod.version and installed["version"] == mod.version:
+                result.skipped += 1
+                self._emit(STAGE_MOD_DONE, mod=mod_name, index=i, total=total, result=RESULT_SKIPPED,
+                           message=installed["version"])
+                continue
+
+            try:
+                self._install_mod(mod, i - 1, total, source_bundle)
+            except (InstallCancelled, installer.DiskSpaceError):
+                raise
+            except Exception as e:
+                if self.token.cancelled:
+                    # Ошибка вызвана отменой (например, оборванное соединение) - это не сбой мода
+                    raise InstallCancelled()
+                logger.error(f"Ошибка при установке мода {mod_name}: {e}")
+                result.failed += 1
+                result.failed_mods.append(mod_name)
+                self._emit(STAGE_MOD_DONE, mod=mod_name, index=i, total=total, result=RESULT_FAILED, message=str(e))
+                if self.options.stop_on_error:
+                    break
+                continue
+
+            result.successful += 1
+            self._emit(STAGE_MOD_DONE, mod=mod_name, index=i, total=total, result=RESULT_OK)
+
+        self.token.check()
+
+        # Финальная статистика
+        if result.successful > 0:
+            logger.success(f"Успешно установлено модов: {result.successful}")
+        if result.skipped > 0:
+            logger.info(f"Уже установлены, пропущено: {result.skipped}")
+        if result.failed > 0:
+            logger.warning(f"Не удалось установить модов: {result.failed}")
+
+        index = self._refresh_index()
+        mod_index.report_duplicates(index)
+        mod_index.report_missing_dependencies(index)
+        logger.info("Установка модов завершена.")
+
+    def _refresh_index(self) -> mod_index.ModIndex:
+        """Загружает и обновляет индекс модов под блокировкой, общей для всех установщиков."""
+        with filelock.named_lock(self.paths.locks_dir, "mod_index", cancel_check=self.token.check):
+            index = mod_index.ModIndex(self.paths.mods_dir, self.paths.mod_index_path)
+            index.refresh()
+        return index
+
+    def _install_mod(self, mod: ModRecord, index: int, total: int,
+                     source_bundle: Optional[bundle.Bundle]):
+        mod_name, url = mod.name, mod.url
+        archive_path = archive_path_for(self.paths.downloads_dir, mod_name, url)
+        archive_file = None
+
+        if source_bundle is not None:
+            # Архив читается прямо из бандла через mmap, без сети и без копирования на диск
+            key = bundle.mod_key(mod_name)
+            if not source_bundle.has(key):
+                raise bundle.BundleError(f"В бандле нет архива мода: {mod_name}")
+            archive_path = self.paths.downloads_dir / source_bundle.member_name(key)
+            archive_file = source_bundle.open(key)
+        else:
+            self._emit(STAGE_DOWNLOAD, mod=mod_name, index=index, total=total)
+            downloader.download_file(url, archive_path, reuse=True, sha256=mod.sha256,
+                                     progress=self._transfer_progress(STAGE_DOWNLOAD, mod_name, index, total),
+                                     cancel_check=self.token.check, on_cancel=self.token.on_cancel)
+
+        try:
+            self.token.check()
+            # Не даём двум установщикам одновременно писать в одну папку мода
+            with filelock.named_lock(self.paths.locks_dir, f"mod:{mod_name}", cancel_check=self.token.check):
+                self._emit(STAGE_EXTRACT, mod=mod_name, index=index, total=total)
+                installer.extract_archive(archive_path, self.paths.mods_dir / mod_name, archive_file,
+                                          cancel_check=self.token.check,
+                                          memory_budget=self.options.memory_budget,
+                                          staging_dir=self.paths.downloads_dir)
+
+                self._emit(STAGE_META, mod=mod_name, index=index, total=total)
+                installer.create_meta_ini(mod_name, self.paths.mods_dir)
+        finally:
+            if archive_file is not None:
+                archive_file.close()
+
+    def _preflight_bundle(self, mods: List[ModRecord], source_bundle: bundle.Bundle):
+        """
+        Сверяет распакованный размер всех модов бандла со свободным местом до начала установки.
+        Повреждённый элемент здесь пропускается: ошибку получит только этот мод в _install_mod.
+        Учитывается и временная копия архива для системного 7z (одна за раз, в кэше загрузок).
+        """
+        required = 0
+        staging = 0
+        for mod in mods:
+            self.token.check()
+            key = bundle.mod_key(mod.name)
+            if not source_bundle.has(key):
+                continue
+            try:
+                with source_bundle.open(key) as archive_file:
+                    member_path = Path(source_bundle.member_name(key))
+                    size = installer.uncompressed_size(member_path, archive_file)
+                    staged = installer.staging_size(member_path, archive_file, self.options.memory_budget)
+            except Exception as e:
+                logger.warning(f"Размер мода {mod.name} не определён, он не учтён в проверке места: {e}")
+                continue
+            required += size or 0
+            staging = max(staging, staged)
+        installer.ensure_free_space_for([(self.paths.mods_dir, required), (self.paths.downloads_dir, staging)])
+        logger.info(f"Места на диске достаточно: потребуется около {required / (1024 * 1024):.1f} МБ")
+
+    def sync_configs(self, github_zip_url: Optional[str], result: InstallResult,
+                     source_bundle: Optional[bundle.Bundle] = None):
+        """Синхронизирует конфигурации с GitHub (или из офлайн-бандла)."""
+        self.token.check()
+        if source_bundle is not None and not source_bundle.has(bundle.CONFIG_KEY):
+            logger.warning("В бандле нет архива конфигураций.")
+            return
+        if source_bundle is None and not github_zip_url:
+            logger.warning("GitHub URL для модпака не указан.")
+            return
+
+        self._emit(STAGE_CONFIGS)
+        paths = self.paths
+        try:
+            # Общая папка распаковки и overwrite/profiles: другой процесс ждёт, пока мы закончим
+            with filelock.named_lock(paths.locks_dir, "github_config", cancel_check=self.token.check):
+                if source_bundle is not None:
+                    logger.info("Распаковываю архив конфигураций из бандла...")
+                    with source_bundle.open(bundle.CONFIG_KEY) as config_zip:
+                        gitpack_sync.extract_config_zip(config_zip, paths.github_extract_dir)
+                else:
+                    logger.info("Загружаю архив конфигураций с GitHub...")
+                    gitpack_sync.download_config_zip(github_zip_url, paths.github_zip_path,
+                                                     progress=self._transfer_progress(STAGE_CONFIGS),
+                                                     cancel_check=self.token.check,
+                                                     on_cancel=self.token.on_cancel)
+
+                    logger.info("Распаковываю архив конфигураций...")
+                    gitpack_sync.extract_config_zip(paths.github_zip_path, paths.github_extract_dir)
+
+                # Применение конфигураций не прерываем, чтобы не оставить overwrite/profiles наполовину
+                logger.info("Применяю конфигурации модпака...")
+                gitpack_sync.apply_configs(paths.github_extract_dir, paths.overwrite_dir, paths.profiles_dir)
+
+            logger.success("Конфигурации успешно применены!")
+        except InstallCancelled:
+            raise
+        except Exception as e:
+            if self.token.cancelled:
+                raise InstallCancelled()
+            logger.error(f"Ошибка при применении пакета с GitHub: {e}")
+            result.errors.append(str(e))
+
+    def clean_cache(self):
+        """Очищает кэш, если пользователь не попросил сохранить его (например, для раздачи по LAN)."""
+        if self.options.keep_cache:
+            logger.info(f"Кэш загрузок сохранён: {self.paths.downloads_dir}")
+            return
+        self._emit(STAGE_CLEANUP)
+        installer.clean_cache(self.paths.cache_dir, self.paths.locks_dir)
@@ -0,0 +1,150 @@
+import os
+import time
+import hashlib
+from pathlib import Path
+from typing import Optional, Callable
+from utils import logger
+
+if os.name == "nt":
+    import msvcrt
+
+    def _try_lock(file) -> bool:
+        file.seek(0)
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(file):
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _try_lock(file) -> bool:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class FileLock:
+    """
+    Межпроцессная эксклюзивная блокировка на lock-файле.
+    Блокировка снимается ОС автоматически, если процесс упал.
+    После захвата атрибут contended показывает, приходилось ли ждать другой процесс.
+    cancel_check вызывается на каждой итерации ожидания: исключение из него прерывает
+    ожидание (так отмена и пауза установки работают и при занятой блокировке).
+    """
+
+    def __init__(self, path: Path, timeout: Optional[float] = None, poll_interval: float = 0.1,
+                 cancel_check: Optional[Callable[[], None]] = None):
+        self.path = Path(path)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.cancel_check = cancel_check
+        self.contended = False
+        self._file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Захватывает блокировку. Возвращает False, если не удалось без ожидания или по таймауту."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        file = open(self.path, "a+b")
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        self.contended = False
+        while not _try_lock(file):
+            if not self.contended:
+                self.contended = True
+                if blocking:
+                    logger.debug(f"Ожидаю блокировку другого процесса: {self.path.name}")
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                file.close()
+                return False
+            if self.cancel_check is not None:
+                try:
+                    self.cancel_check()
+                except BaseException:
+                    file.close()
+                    raise
+            time.sleep(self.poll_interval)
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            _unlock(self._file)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise TimeoutError(f"Не удалось захватить блокировку: {self.path}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def named_lock(locks_dir: Path, key: str, **kwargs) -> FileLock:
+    """Блокировка по произвольному ключу (имя мода, URL и т.п.)."""
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return FileLock(Path(locks_dir) / f"{digest}.lock", **kwargs)
+
+
+def sidecar_lock(path: Path, **kwargs) -> FileLock:
+    """Блокировка, лежащая рядом с защищаемым файлом: <имя>.lock."""
+    path = Path(path)
+    return FileLock(path.with_name(path.name + ".lock"), **kwargs)
+
+
+class CacheSession:
+    """
+    Регистрирует текущий процесс как пользователя общего кэша.
+    Пока сессия открыта, clean_cache других процессов не удалит кэш.
+    """
+
+    def __init__(self, locks_dir: Path):
+        self.locks_dir = Path(locks_dir)
+        self._lock = FileLock(self.locks_dir / "sessions" / f"{os.getpid()}.lock")
+
+    def __enter__(self):
+        with FileLock(self.locks_dir / "cache.lock"):
+            self._lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._lock.release()
+        try:
+            self._lock.path.unlink()
+        except OSError:
+            pass
+
+
+def other_sessions_active(locks_dir: Path) -> bool:
+    """Проверяет, держит ли кэш другой процесс. Попутно удаляет файлы упавших сессий."""
+    sessions_dir = Path(locks_dir) / "sessions"
+    if not sessions_dir.exists():
+        return False
+    active = False
+    own = f"{os.getpid()}.lock"
+    for session_file in sessions_dir.glob("*.lock"):
+        if session_file.name == own:
+            continue
+        probe = FileLock(session_file)
+        if not probe.acquire(blocking=False):
+            active = True
+            continue
+        probe.release()
+        try:
+            session_file.unlink()
+        except OSError:
+            pass
+    return active
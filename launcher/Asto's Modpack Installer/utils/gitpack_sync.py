@@ -1,31 +1,29 @@
 import zipfile
 import shutil
 from pathlib import Path
-import requests
-from utils import logger
+from utils import logger, downloader, installer
 
-def download_config_zip(url: str, output_path: Path):
+def download_config_zip(url: str, output_path: Path, progress=None, cancel_check=None, on_cancel=None):
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
-        with open(output_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
+        # Атомарная загрузка под блокировкой: параллельный процесс дождётся и переиспользует архив
+        downloader.download_file(url, output_path, progress=progress, cancel_check=cancel_check,
+                                 on_cancel=on_cancel)
         logger.log(f"Загружен архив конфигураций: {output_path.name}")
 
     except Exception as e:
         logger.log(f"Ошибка при загрузке архива конфигураций: {e}")
         raise
 
-def extract_config_zip(zip_path: Path, extract_to: Path):
+def extract_config_zip(zip_path, extract_to: Path):
+    # zip_path может быть путём или файловым объектом (архив из офлайн-бандла)
     try:
         if extract_to.exists():
             shutil.rmtree(extract_to)
         extract_to.mkdir(parents=True, exist_ok=True)
 
         with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            # Проверяем место заранее, чтобы не оставить конфигурацию распакованной наполовину
+            installer.ensure_free_space(extract_to, sum(info.file_size for info in zip_ref.infolist()))
             zip_ref.extractall(extract_to)
 
         logger.log(f"Распакован архив конфигураций в: {extract_to}")
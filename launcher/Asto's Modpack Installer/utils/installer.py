@@ -1,63 +1,309 @@
 import zipfile, shutil
+import io
+import os
+import re
 import subprocess
-from typing import Optional
+import tempfile
+from typing import Optional, BinaryIO, Callable, List, Tuple
 from pathlib import Path
-from utils import logger
+from utils import logger, filelock
 
-def extract_zip(zip_path: Path, extract_to: Path):
-    """Распаковывает ZIP-архив в указанную папку."""
-    with zipfile.ZipFile(zip_path, "r") as archive:
-        archive.extractall(extract_to)
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024  # Предел памяти декодера .7z (словарь LZMA/LZMA2, модель PPMd)
+COPY_CHUNK_SIZE = 1024 * 1024
+DISK_RESERVE = 64 * 1024 * 1024  # Запас свободного места, чтобы не заполнять диск до нуля
+
+class DiskSpaceError(OSError):
+    """Недостаточно места на диске для распаковки."""
+
+def _format_mb(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} МБ"
+
+def _existing_path(path: Path) -> Path:
+    """Ближайший существующий путь (сама папка может быть ещё не создана)."""
+    probe = Path(path)
+    while not probe.exists() and probe.parent != probe:
+        probe = probe.parent
+    return probe
+
+def ensure_free_space(target_dir: Path, required: int, reserve: int = DISK_RESERVE):
+    """Проверяет, что на томе target_dir хватит места для required байт (плюс запас)."""
+    probe = _existing_path(target_dir)
+    free = shutil.disk_usage(probe).free
+    if required + reserve > free:
+        raise DiskSpaceError(
+            f"Недостаточно места на диске ({probe.anchor or probe}): "
+            f"нужно {_format_mb(required + reserve)}, свободно {_format_mb(free)}"
+        )
+
+def ensure_free_space_for(requirements: List[Tuple[Path, int]]):
+    """Проверяет место сразу для нескольких папок; требования к одному тому складываются."""
+    by_volume = {}
+    for path, size in requirements:
+        device = os.stat(_existing_path(path)).st_dev
+        entry = by_volume.setdefault(device, [path, 0])
+        entry[1] += size
+    for path, size in by_volume.values():
+        ensure_free_space(path, size)
+
+def _safe_member_path(extract_to: Path, name: str) -> Optional[Path]:
+    """Путь файла из архива внутри extract_to (без абсолютных путей и '..')."""
+    name = re.sub(r"^[A-Za-z]:", "", name)
+    parts = [part for part in re.split(r"[\\/]", name) if part not in ("", ".", "..")]
+    if not parts:
+        return None
+    return extract_to.joinpath(*parts)
+
+def _sevenzip_sizes_system(archive_path: Path) -> Optional[List[int]]:
+    try:
+        result = subprocess.run(
+            ["7z", "l", "-slt", "-ba", str(archive_path)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    return [int(size) for size in re.findall(r"^Size = (\d+)$", result.stdout, re.MULTILINE)]
+
+def uncompressed_size(archive_path: Path, fileobj: Optional[BinaryIO] = None) -> Optional[int]:
+    """Суммарный распакованный размер по заголовкам архива или None, если его не узнать."""
+    suffix = archive_path.suffix.lower()
+    if fileobj is not None:
+        fileobj.seek(0)
+    if suffix == ".zip":
+        with zipfile.ZipFile(fileobj or archive_path, "r") as archive:
+            return sum(info.file_size for info in archive.infolist())
+    if suffix == ".7z":
+        try:
+            import py7zr  # type: ignore
+        except Exception:
+            py7zr = None
+        if py7zr is not None:
+            with py7zr.SevenZipFile(fileobj or archive_path, mode='r') as z:
+                return sum(info.uncompressed or 0 for info in z.list())
+        if fileobj is None:
+            sizes = _sevenzip_sizes_system(archive_path)
+            if sizes is not None:
+                return sum(sizes)
+    return None
+
+def extract_zip(zip_path: Path, extract_to: Path, fileobj: Optional[BinaryIO] = None,
+                cancel_check: Optional[Callable[[], None]] = None):
+    """
+    Распаковывает ZIP-архив в указанную папку потоково: файлы пишутся на диск чанками
+    по COPY_CHUNK_SIZE, поэтому память не зависит от размера архива (окно Deflate - 32 КБ).
+    cancel_check вызывается на каждом чанке.
+    """
+    with zipfile.ZipFile(fileobj or zip_path, "r") as archive:
+        for member in archive.infolist():
+            if cancel_check is not None:
+                cancel_check()
+            target = _safe_member_path(extract_to, member.filename)
+            if target is None:
+                continue
+            if member.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with archive.open(member) as source, open(target, "wb") as dest:
+                while True:
+                    chunk = source.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    if cancel_check is not None:
+                        cancel_check()
     logger.log(f"Распакован: {zip_path.name}")
 
-def _extract_7z_with_py7zr(archive_path: Path, extract_to: Path) -> bool:
+# Идентификаторы методов сжатия 7z, для которых известна память декодера
+_LZMA = b"\x03\x01\x01"
+_LZMA2 = b"\x21"
+_PPMD = b"\x03\x04\x01"
+_BZIP2 = b"\x04\x02\x02"
+_BZIP2_MEMORY = 4 * 1024 * 1024
+
+def _coder_memory(coder) -> int:
+    """Память декодера по свойствам кодера из заголовка 7z (0 - метод без большого словаря)."""
+    method, props = coder.get("method"), coder.get("properties") or b""
+    if method == _LZMA and len(props) >= 5:
+        return int.from_bytes(props[1:5], "little")
+    if method == _LZMA2 and props:
+        bits = props[0] & 0x3F
+        return 0xFFFFFFFF if bits >= 40 else (2 | (bits & 1)) << (bits // 2 + 11)
+    if method == _PPMD and len(props) >= 5:
+        return int.from_bytes(props[1:5], "little")
+    if method == _BZIP2:
+        return _BZIP2_MEMORY
+    return 0
+
+def decoder_memory(archive_path: Path, fileobj: Optional[BinaryIO] = None) -> Optional[int]:
+    """
+    Сколько памяти нужно декодеру .7z: наибольший словарь (или модель PPMd) среди блоков архива.
+    None, если py7zr не установлен или заголовок не читается.
+    """
     try:
         import py7zr  # type: ignore
     except Exception:
+        return None
+    try:
+        if fileobj is not None:
+            fileobj.seek(0)
+        with py7zr.SevenZipFile(fileobj or archive_path, mode='r') as z:
+            folders = z.header.main_streams.unpackinfo.folders if z.header.main_streams else []
+            return max((_coder_memory(c) for folder in folders for c in folder.coders), default=0)
+    except Exception as e:
+        logger.debug(f"Не удалось прочитать заголовок {archive_path.name}: {e}")
+        return None
+
+def _use_system_7z(archive_path: Path, fileobj: Optional[BinaryIO], memory_budget: int, warn: bool = True) -> bool:
+    """
+    Выбирает распаковщик .7z: py7zr работает в процессе установщика, поэтому архив, декодеру
+    которого нужно больше memory_budget, отдаём системному 7z (отдельный процесс).
+    """
+    required = decoder_memory(archive_path, fileobj)
+    if required is None:
+        return True  # py7zr недоступен или не справится - остаётся только системный 7z
+    if required <= memory_budget:
         return False
+    if shutil.which("7z") is not None:
+        return True
+    if warn:
+        logger.warning(
+            f"{archive_path.name}: декодеру нужно {_format_mb(required)} при лимите {_format_mb(memory_budget)}, "
+            f"но системный 7z не найден - распаковываю через py7zr"
+        )
+    return False
+
+def staging_size(archive_path: Path, fileobj: Optional[BinaryIO], memory_budget: int = DEFAULT_MEMORY_BUDGET) -> int:
+    """Сколько места займёт временная копия архива из fileobj для системного 7z (0 - копия не нужна)."""
+    if fileobj is None or archive_path.suffix.lower() != ".7z":
+        return 0
+    if not _use_system_7z(archive_path, fileobj, memory_budget, warn=False):
+        return 0
+    return fileobj.seek(0, io.SEEK_END)
+
+def _extract_7z_with_py7zr(archive_path: Path, extract_to: Path, fileobj: Optional[BinaryIO] = None) -> bool:
     try:
-        with py7zr.SevenZipFile(archive_path, mode='r') as z:
+        import py7zr  # type: ignore
+    except Exception:
+        return False
+    try:
+        if fileobj is not None:
+            fileobj.seek(0)
+        with py7zr.SevenZipFile(fileobj or archive_path, mode='r') as z:
             z.extractall(path=extract_to)
-        logger.log(f"Распакован (7z, py7zr): {archive_path.name}")
-        return True
     except Exception as e:
         logger.error(f"py7zr не смог распаковать {archive_path.name}: {e}")
         return False
+    logger.log(f"Распакован (7z, py7zr): {archive_path.name}")
+    return True
 
-def _extract_7z_with_system(archive_path: Path, extract_to: Path) -> bool:
+def _extract_7z_with_system(archive_path: Path, extract_to: Path,
+                            cancel_check: Optional[Callable[[], None]] = None) -> bool:
     # Требуется установленный 7z (пакет p7zip-full / p7zip)
     try:
         extract_to.mkdir(parents=True, exist_ok=True)
-        result = subprocess.run(
-            ["7z", "x", "-y", f"-o{str(extract_to)}", str(archive_path)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=False,
-        )
-        if result.returncode == 0:
-            logger.log(f"Распакован (7z, system): {archive_path.name}")
-            return True
-        logger.error(f"7z вернул код {result.returncode}: {result.stderr}")
-        return False
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(
+                ["7z", "x", "-y", f"-o{str(extract_to)}", str(archive_path)],
+                stdout=subprocess.DEVNULL,
+                stderr=stderr,
+            )
+            # Ждём процесс короткими интервалами, чтобы отмена могла его остановить
+            while True:
+                try:
+                    returncode = process.wait(timeout=0.1)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel_check is None:
+                        continue
+                    try:
+                        cancel_check()
+                    except BaseException:
+                        process.kill()
+                        process.wait()
+                        raise
+            if returncode == 0:
+                logger.log(f"Распакован (7z, system): {archive_path.name}")
+                return True
+            stderr.seek(0)
+            logger.error(f"7z вернул код {returncode}: {stderr.read().decode(errors='replace')}")
+            return False
     except FileNotFoundError:
         logger.error("Команда '7z' не найдена. Установите py7zr (python) или p7zip (system).")
         return False
 
-def extract_archive(archive_path: Path, extract_to: Path):
-    """Распаковывает архив (.zip, .7z) в указанную папку."""
+def _extract_7z_with_system_from_fileobj(archive_path: Path, extract_to: Path, fileobj: BinaryIO,
+                                         staging_dir: Path,
+                                         cancel_check: Optional[Callable[[], None]] = None) -> bool:
+    # Системному 7z нужен файл на диске. Копию кладём в staging_dir (кэш загрузок), а не в
+    # системный temp: он бывает в RAM (tmpfs) и на другом томе, не учтённом в проверке места
+    stage_dir = staging_dir / f".stage-{os.getpid()}"
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = stage_dir / archive_path.name
+    try:
+        fileobj.seek(0)
+        with open(tmp_path, "wb") as tmp_file:
+            while True:
+                chunk = fileobj.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                tmp_file.write(chunk)
+                if cancel_check is not None:
+                    cancel_check()
+        return _extract_7z_with_system(tmp_path, extract_to, cancel_check)
+    finally:
+        shutil.rmtree(stage_dir, ignore_errors=True)
+
+def extract_archive(archive_path: Path, extract_to: Path, fileobj: Optional[BinaryIO] = None,
+                    cancel_check: Optional[Callable[[], None]] = None,
+                    memory_budget: int = DEFAULT_MEMORY_BUDGET, check_space: bool = True,
+                    staging_dir: Optional[Path] = None):
+    """
+    Распаковывает архив (.zip, .7z) в указанную папку.
+    Если передан fileobj, архив читается из него (например, из бандла), а archive_path
+    задаёт только имя и формат. cancel_check позволяет прервать распаковку ZIP и системным 7z;
+    распаковка через py7zr посреди работы не прерывается.
+
+    Перед распаковкой распакованный размер из заголовков архива сверяется со свободным
+    местом на томе extract_to (DiskSpaceError). ZIP распаковывается потоково.
+    memory_budget - предел памяти декодера .7z в процессе установщика: архив с большим
+    словарём распаковывается системным 7z, а если его нет - py7zr с предупреждением.
+    Если системному 7z нужен архив из fileobj, его копия пишется в staging_dir
+    (по умолчанию - рядом с extract_to) и тоже учитывается в проверке места.
+    """
     suffix = archive_path.suffix.lower()
+    if suffix not in (".zip", ".7z"):
+        # Неизвестный формат
+        raise ValueError(f"Неподдерживаемый формат архива: {suffix}")
+
+    staging_dir = Path(staging_dir) if staging_dir is not None else extract_to.parent
+    if check_space:
+        size = uncompressed_size(archive_path, fileobj)
+        if size is not None:
+            ensure_free_space_for([(extract_to, size),
+                                   (staging_dir, staging_size(archive_path, fileobj, memory_budget))])
+        else:
+            logger.warning(f"Не удалось определить распакованный размер {archive_path.name}, проверка места пропущена")
+
     if suffix == ".zip":
-        return extract_zip(archive_path, extract_to)
-    if suffix == ".7z":
-        # Сначала пытаемся py7zr, затем системный 7z
-        if _extract_7z_with_py7zr(archive_path, extract_to):
+        return extract_zip(archive_path, extract_to, fileobj, cancel_check)
+
+    if cancel_check is not None:
+        cancel_check()
+    # Сначала пытаемся py7zr (если его декодер укладывается в бюджет), затем системный 7z
+    if not _use_system_7z(archive_path, fileobj, memory_budget):
+        if _extract_7z_with_py7zr(archive_path, extract_to, fileobj):
             return
-        if _extract_7z_with_system(archive_path, extract_to):
+    if fileobj is not None:
+        if _extract_7z_with_system_from_fileobj(archive_path, extract_to, fileobj, staging_dir, cancel_check):
             return
-        raise RuntimeError("Не удалось распаковать .7z архив: отсутствует py7zr и/или системный 7z")
-    # Неизвестный формат
-    raise ValueError(f"Неподдерживаемый формат архива: {suffix}")
+    elif _extract_7z_with_system(archive_path, extract_to, cancel_check):
+        return
+    raise RuntimeError("Не удалось распаковать .7z архив: отсутствует py7zr и/или системный 7z")
 
 def create_meta_ini(mod_name: str, mods_dir: Path, version: str = "1.0"):
     """Создаёт минимальный meta.ini для мода."""
@@ -74,8 +320,20 @@ repository=Local
 
     logger.log(f"Создан meta.ini для мода: {mod_name}")
 
-def clean_cache(cache_dir):
-    """Удаляет содержимое папки кэша."""
+def clean_cache(cache_dir, locks_dir: Optional[Path] = None):
+    """
+    Удаляет содержимое папки кэша.
+    Если указан locks_dir, кэш не трогается, пока им пользуется другой запущенный установщик.
+    """
+    if locks_dir is None:
+        return _remove_cache(cache_dir)
+    with filelock.FileLock(Path(locks_dir) / "cache.lock"):
+        if filelock.other_sessions_active(locks_dir):
+            logger.log(f"Кэш используется другим процессом, очистка пропущена: {cache_dir}")
+            return
+        _remove_cache(cache_dir)
+
+def _remove_cache(cache_dir):
     if cache_dir.exists() and cache_dir.is_dir():
         shutil.rmtree(cache_dir)
         logger.log(f"Очищен кэш: {cache_dir}")
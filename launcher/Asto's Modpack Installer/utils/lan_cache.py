@@ -0,0 +1,220 @@
+import os
+import json
+import shutil
+import socket
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Callable
+from urllib.parse import quote, unquote
+from utils import logger
+
+DEFAULT_PORT = 8765
+INDEX_PATH = "/index.json"
+FILES_PREFIX = "/files/"
+PEER_TIMEOUT = (2, 30)  # (подключение, чтение) - недоступный пир не должен тормозить установку
+CHUNK_SIZE = 64 * 1024
+
+# Служебные файлы рядом с архивом в кэше загрузок
+URL_SUFFIX = ".url"
+SHA256_SUFFIX = ".sha256"
+_SERVICE_SUFFIXES = (URL_SUFFIX, SHA256_SUFFIX, ".lock", ".part")
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_sha256(path: Path) -> str:
+    """sha256 архива из файла <имя>.sha256; пересчитывается, если архив новее."""
+    sidecar = path.with_name(path.name + SHA256_SUFFIX)
+    try:
+        if sidecar.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+            return sidecar.read_text(encoding="utf-8").strip()
+    except OSError:
+        pass
+    digest = file_sha256(path)
+    try:
+        sidecar.write_text(digest, encoding="utf-8")
+    except OSError:
+        pass
+    return digest
+
+
+def _abort_response(response):
+    """Прерывает чтение ответа из другого потока: shutdown сокета будит зависший recv, close() - нет."""
+    connection = getattr(getattr(response, "raw", None), "_connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+@contextmanager
+def abort_on_cancel(response, on_cancel: Optional[Callable[[Callable[[], None]], Callable[[], None]]]):
+    """
+    Пока открыт блок, отмена (on_cancel регистрирует колбэк и возвращает функцию снятия
+    регистрации) сразу обрывает соединение, даже если сервер перестал присылать данные.
+    Возвращает список, в который при обрыве добавляется True.
+    """
+    aborted: List[bool] = []
+
+    def abort():
+        aborted.append(True)
+        _abort_response(response)
+
+    unregister = on_cancel(abort) if on_cancel is not None else None
+    try:
+        yield aborted
+    finally:
+        if unregister is not None:
+            unregister()
+
+
+def build_index(downloads_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """Индекс кэша: {исходный URL: {name, size, sha256}} по архивам с известным URL."""
+    index = {}
+    if not downloads_dir.exists():
+        return index
+    for path in downloads_dir.iterdir():
+        if not path.is_file() or path.name.endswith(_SERVICE_SUFFIXES):
+            continue
+        marker = path.with_name(path.name + URL_SUFFIX)
+        try:
+            url = marker.read_text(encoding="utf-8")
+            index[url] = {"name": path.name, "size": path.stat().st_size, "sha256": cached_sha256(path)}
+        except OSError:
+            continue
+    return index
+
+
+class _CacheRequestHandler(BaseHTTPRequestHandler):
+    downloads_dir: Path = Path(".")
+
+    def do_GET(self):
+        if self.path == INDEX_PATH:
+            body = json.dumps(build_index(self.downloads_dir)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.path.startswith(FILES_PREFIX):
+            name = unquote(self.path[len(FILES_PREFIX):])
+            path = self.downloads_dir / name
+            # Отдаём только архивы из корня кэша, без выхода за его пределы
+            if "/" in name or "\\" in name or name.startswith(".") or name.endswith(_SERVICE_SUFFIXES) or not path.is_file():
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(path.stat().st_size))
+            self.end_headers()
+            with open(path, "rb") as file:
+                shutil.copyfileobj(file, self.wfile, CHUNK_SIZE)
+            return
+
+        self.send_error(404)
+
+    def log_message(self, format, *args):
+        logger.debug(f"LAN-кэш {self.client_address[0]}: {format % args}")
+
+
+def serve(downloads_dir: Path, host: str = "0.0.0.0", port: int = DEFAULT_PORT):
+    """
+    Раздаёт локальный кэш архивов по HTTP другим установщикам в сети (до Ctrl+C).
+    Кэш наполняется только установками с --keep-cache: обычная установка очищает его в конце.
+    """
+    handler = type("CacheRequestHandler", (_CacheRequestHandler,), {"downloads_dir": Path(downloads_dir)})
+    with ThreadingHTTPServer((host, port), handler) as server:
+        count = len(build_index(Path(downloads_dir)))
+        logger.success(f"LAN-кэш запущен на http://{host}:{port} (архивов: {count}). Ctrl+C для остановки.")
+        if count == 0:
+            logger.warning("Раздавать нечего: после установки кэш очищается. Установите модпак с --keep-cache, "
+                           "затем снова запустите --serve.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("LAN-кэш остановлен.")
+
+
+class PeerSet:
+    """Список LAN-пиров; индекс каждого пира запрашивается один раз за запуск."""
+
+    def __init__(self, peers: List[str]):
+        self.peers = [p.rstrip("/") for p in peers if p]
+        self._indexes: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._unpinned_reported = False
+
+    def _index(self, session, peer: str, on_cancel=None) -> Optional[Dict[str, Any]]:
+        if peer not in self._indexes:
+            aborted: List[bool] = []
+            try:
+                with session.get(peer + INDEX_PATH, stream=True, timeout=PEER_TIMEOUT) as response, \
+                        abort_on_cancel(response, on_cancel) as aborted:
+                    response.raise_for_status()
+                    self._indexes[peer] = response.json()
+            except Exception as e:
+                if aborted:
+                    return None  # Прервано отменой - пир не считаем недоступным
+                logger.debug(f"LAN-пир недоступен {peer}: {e}")
+                self._indexes[peer] = None
+        return self._indexes[peer]
+
+    def fetch(self, session, url: str, tmp_path: Path, expected_sha256: Optional[str] = None,
+              progress=None, on_cancel=None) -> Optional[str]:
+        """
+        Пытается скачать файл с исходным URL у пиров в tmp_path.
+        Пиры не доверенные, поэтому к ним обращаемся только при известном sha256 из модлиста;
+        хэш из индекса пира не используется. Без sha256 сразу возвращается None.
+        Возвращает sha256 скачанного файла или None. Исключения из progress не глотаются;
+        оборванную отменой (on_cancel) загрузку вызывающий код распознаёт сам.
+        """
+        if not expected_sha256:
+            if self.peers and not self._unpinned_reported:
+                self._unpinned_reported = True
+                logger.warning("LAN-пиры не используются для модов без sha256 в модлисте. "
+                               "Добавить хэши в модлист: main.py --pin-hashes <модлист.json>")
+            return None
+        want = expected_sha256.lower()
+        for peer in self.peers:
+            entry = (self._index(session, peer, on_cancel) or {}).get(url)
+            if not entry:
+                continue
+            try:
+                digest = hashlib.sha256()
+                done = 0
+                with session.get(peer + FILES_PREFIX + quote(entry["name"]), stream=True, timeout=PEER_TIMEOUT) as response, \
+                        abort_on_cancel(response, on_cancel):
+                    response.raise_for_status()
+                    with open(tmp_path, "wb") as file:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            digest.update(chunk)
+                            file.write(chunk)
+                            done += len(chunk)
+                            if progress is not None:
+                                progress(done, entry.get("size", 0))
+            except OSError as e:  # Сетевые ошибки requests - тоже OSError; отмена из progress пробрасывается
+                logger.debug(f"Не удалось скачать {entry['name']} у {peer}: {e}")
+                continue
+            if digest.hexdigest() != want:
+                logger.warning(f"Хэш {entry['name']} от {peer} не совпал, файл отброшен")
+                continue
+            logger.log(f"Получен из LAN-кэша {peer}: {entry['name']}")
+            return want
+        if tmp_path.exists():
+            os.remove(tmp_path)
+        return None
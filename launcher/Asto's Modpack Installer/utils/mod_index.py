@@ -0,0 +1,305 @@
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from utils import logger
+
+INDEX_VERSION = 2
+MANIFEST_NAME = "manifest.json"
+
+# SMAPI читает manifest.json через Json.NET, который прощает комментарии и висячие запятые
+_COMMENT_RE = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r'("(?:\\.|[^"\\])*")|,(\s*[}\]])')
+
+
+def _parse_manifest(manifest_path: Path) -> Optional[Dict[str, Any]]:
+    """Читает manifest.json мода SMAPI, допуская комментарии и висячие запятые."""
+    try:
+        text = manifest_path.read_text(encoding="utf-8-sig")
+    except OSError as e:
+        logger.warning(f"Не удалось прочитать {manifest_path}: {e}")
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    text = _COMMENT_RE.sub(lambda m: m.group(1) or "", text)
+    text = _TRAILING_COMMA_RE.sub(lambda m: m.group(1) or m.group(2), text)
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        logger.warning(f"Некорректный manifest.json ({manifest_path}): {e}")
+        return None
+
+
+def _get(data: Dict[str, Any], key: str, default=None):
+    """Достаёт поле манифеста без учёта регистра (как это делает SMAPI)."""
+    if key in data:
+        return data[key]
+    lowered = key.lower()
+    for k, v in data.items():
+        if isinstance(k, str) and k.lower() == lowered:
+            return v
+    return default
+
+
+def _manifest_record(data: Dict[str, Any], folder: str, rel_dir: str, file_count: int) -> Optional[Dict[str, Any]]:
+    """Приводит manifest.json к компактной записи индекса."""
+    unique_id = _get(data, "UniqueID")
+    if not isinstance(unique_id, str) or not unique_id.strip():
+        return None
+
+    dependencies = []
+    for dep in _get(data, "Dependencies") or []:
+        if not isinstance(dep, dict) or not _get(dep, "UniqueID"):
+            continue
+        dependencies.append({
+            "unique_id": str(_get(dep, "UniqueID")),
+            "min_version": _get(dep, "MinimumVersion"),
+            "required": bool(_get(dep, "IsRequired", True)),
+        })
+
+    content_pack_for = _get(data, "ContentPackFor")
+    if isinstance(content_pack_for, dict) and _get(content_pack_for, "UniqueID"):
+        dependencies.append({
+            "unique_id": str(_get(content_pack_for, "UniqueID")),
+            "min_version": _get(content_pack_for, "MinimumVersion"),
+            "required": True,
+        })
+
+    return {
+        "unique_id": unique_id.strip(),
+        "name": _get(data, "Name") or unique_id,
+        "version": str(_get(data, "Version") or ""),
+        "dependencies": dependencies,
+        "folder": folder,
+        "path": rel_dir,
+        "file_count": file_count,
+    }
+
+
+def _join(rel_dir: str, name: str) -> str:
+    return f"{rel_dir}/{name}" if rel_dir else name
+
+
+def _scan_folder(folder_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Полностью сканирует папку мода MO2: ищет все manifest.json (как SMAPI,
+    не спускаясь внутрь найденного мода) и считает файлы каждого мода.
+    Внутри найденного мода запоминаются mtime всех подкаталогов, чтобы число файлов
+    не устаревало при добавлении файлов во вложенные папки.
+    Возвращает None, если папка исчезла во время сканирования.
+    """
+    folder = folder_path.name
+    mods: List[Dict[str, Any]] = []
+    watch: Dict[str, int] = {}
+
+    def walk(dir_path: Path, rel_dir: str):
+        try:
+            entries = list(os.scandir(dir_path))
+            watch[rel_dir] = dir_path.stat().st_mtime_ns
+        except OSError:
+            return
+        names = {e.name.lower(): e for e in entries}
+        manifest_entry = names.get(MANIFEST_NAME)
+        if manifest_entry is not None and manifest_entry.is_file():
+            try:
+                watch[_join(rel_dir, manifest_entry.name)] = manifest_entry.stat().st_mtime_ns
+            except OSError:
+                return
+            data = _parse_manifest(Path(manifest_entry.path))
+            file_count = 0
+            for root, _, files in os.walk(dir_path):
+                file_count += len(files)
+                rel_root = os.path.relpath(root, folder_path).replace(os.sep, "/")
+                rel_root = "" if rel_root == "." else rel_root
+                try:
+                    watch[rel_root] = os.stat(root).st_mtime_ns
+                except OSError:
+                    continue
+            record = _manifest_record(data, folder, rel_dir, file_count) if isinstance(data, dict) else None
+            if record:
+                mods.append(record)
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."):
+                walk(Path(entry.path), _join(rel_dir, entry.name))
+
+    walk(folder_path, "")
+    if "" not in watch:
+        return None
+    return {"watch": watch, "mods": mods}
+
+
+def _folder_changed(folder_path: Path, watch: Dict[str, int]) -> bool:
+    """Проверяет сохранённые mtime каталогов и манифестов папки мода."""
+    for rel, mtime_ns in watch.items():
+        try:
+            if (folder_path / rel).stat().st_mtime_ns != mtime_ns:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+class ModIndex:
+    """Постоянный индекс установленных модов SMAPI с инкрементальным обновлением по mtime."""
+
+    def __init__(self, mods_dir: Path, index_path: Path):
+        self.mods_dir = Path(mods_dir)
+        self.index_path = Path(index_path)
+        self.folders: Dict[str, Dict[str, Any]] = {}
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.duplicates: Dict[str, List[Dict[str, Any]]] = {}
+        self._load()
+
+    def _load(self):
+        """Загружает индекс с диска; повреждённый или устаревший индекс игнорируется."""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Индекс модов повреждён и будет перестроен: {e}")
+            return
+        if data.get("version") != INDEX_VERSION or data.get("mods_dir") != str(self.mods_dir):
+            return
+        self.folders = data.get("folders", {})
+        self._rebuild_lookup()
+
+    def save(self):
+        """Атомарно сохраняет индекс на диск."""
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        # Имя временного файла уникально для процесса: параллельные установщики не пишут в один файл
+        tmp_path = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "version": INDEX_VERSION,
+                "mods_dir": str(self.mods_dir),
+                "folders": self.folders,
+            }, file, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+
+    def _rebuild_lookup(self):
+        # Папки обходим по имени, чтобы при дублях UniqueID результат не зависел от порядка словаря
+        self.by_id = {}
+        self.duplicates = {}
+        for name in sorted(self.folders):
+            for mod in self.folders[name].get("mods", []):
+                key = mod["unique_id"].lower()
+                if key in self.by_id:
+                    self.duplicates.setdefault(key, [self.by_id[key]]).append(mod)
+                else:
+                    self.by_id[key] = mod
+
+    def refresh(self) -> Tuple[int, int]:
+        """
+        Обновляет индекс: пересканирует только новые и изменившиеся папки,
+        удаляет исчезнувшие. Возвращает (пересканировано, удалено).
+        """
+        rescanned = 0
+        current = set()
+        if self.mods_dir.exists():
+            for entry in os.scandir(self.mods_dir):
+                if not entry.is_dir() or entry.name.startswith("."):
+                    continue
+                current.add(entry.name)
+                cached = self.folders.get(entry.name)
+                folder_path = Path(entry.path)
+                if cached is None or _folder_changed(folder_path, cached.get("watch", {})):
+                    scanned = _scan_folder(folder_path)
+                    if scanned is None:
+                        # Папку удалили во время обновления - считаем её исчезнувшей
+                        current.discard(entry.name)
+                        continue
+                    self.folders[entry.name] = scanned
+                    rescanned += 1
+
+        removed = [name for name in self.folders if name not in current]
+        for name in removed:
+            del self.folders[name]
+
+        if rescanned or removed:
+            self._rebuild_lookup()
+            self.save()
+        return rescanned, len(removed)
+
+    def get(self, unique_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает запись мода по UniqueID (без учёта регистра) или None."""
+        return self.by_id.get(unique_id.lower())
+
+    def mods(self) -> List[Dict[str, Any]]:
+        """Все установленные моды (включая дубли UniqueID), отсортированные по имени."""
+        mods = [mod for folder in self.folders.values() for mod in folder.get("mods", [])]
+        return sorted(mods, key=lambda m: (str(m["name"]).lower(), m["folder"]))
+
+    def missing_dependencies(self) -> List[Dict[str, Any]]:
+        """Ищет обязательные зависимости, которые не установлены или слишком старые."""
+        problems = []
+        for mod in sorted(self.by_id.values(), key=lambda m: str(m["name"]).lower()):
+            for dep in mod["dependencies"]:
+                if not dep["required"] or dep["unique_id"].lower() == "smapi":
+                    continue
+                installed = self.get(dep["unique_id"])
+                if installed is None:
+                    problems.append({"mod": mod, "dependency": dep, "installed_version": None})
+                elif dep["min_version"] and compare_versions(installed["version"], str(dep["min_version"])) < 0:
+                    problems.append({"mod": mod, "dependency": dep, "installed_version": installed["version"]})
+        return problems
+
+
+def _version_key(version: str):
+    """Ключ сравнения семантической версии SMAPI (1.2.3-beta.1 < 1.2.3)."""
+    main, _, prerelease = version.strip().lstrip("vV").partition("-")
+    numbers = []
+    for part in main.split("."):
+        digits = re.match(r"\d*", part).group()
+        numbers.append(int(digits) if digits else 0)
+    while len(numbers) < 3:
+        numbers.append(0)
+    tags = tuple((0, int(p), "") if p.isdigit() else (1, 0, p.lower()) for p in prerelease.split(".") if p)
+    # Версия без пре-релизной метки старше любой пре-релизной
+    return tuple(numbers), (1,) if not tags else (0, tags)
+
+
+def compare_versions(left: str, right: str) -> int:
+    """Сравнивает две версии: -1, 0 или 1."""
+    a, b = _version_key(left), _version_key(right)
+    return (a > b) - (a < b)
+
+
+def print_status(index: ModIndex):
+    """Печатает список установленных модов и проблемы с зависимостями."""
+    mods = index.mods()
+    logger.info(f"Установлено модов SMAPI: {len(mods)}")
+    for mod in mods:
+        print(f"  {mod['name']} {mod['version']}  [{mod['unique_id']}]  ({mod['folder']}, файлов: {mod['file_count']})")
+
+    report_duplicates(index)
+    if not report_missing_dependencies(index):
+        logger.success("Все обязательные зависимости установлены.")
+
+
+def report_duplicates(index: ModIndex) -> int:
+    """Предупреждает о модах с одинаковым UniqueID: SMAPI не загрузит ни один из них. Возвращает число дублей."""
+    for mods in index.duplicates.values():
+        folders = ", ".join(f"{mod['folder']}/{mod['path']}".rstrip("/") for mod in mods)
+        logger.warning(f"UniqueID {mods[0]['unique_id']} установлен несколько раз ({folders}) - SMAPI не загрузит дубли")
+    return len(index.duplicates)
+
+
+def report_missing_dependencies(index: ModIndex) -> int:
+    """Пишет в лог предупреждения об отсутствующих зависимостях. Возвращает их число."""
+    problems = index.missing_dependencies()
+    for problem in problems:
+        mod, dep = problem["mod"], problem["dependency"]
+        if problem["installed_version"] is None:
+            logger.warning(f"{mod['name']}: не установлена обязательная зависимость {dep['unique_id']}")
+        else:
+            logger.warning(
+                f"{mod['name']}: требуется {dep['unique_id']} >= {dep['min_version']}, "
+                f"установлена {problem['installed_version']}"
+            )
+    return len(problems)
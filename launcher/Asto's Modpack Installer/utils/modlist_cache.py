@@ -0,0 +1,263 @@
+import os
+import re
+import copy
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable
+from urllib.parse import urlparse
+from utils import logger
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
+# Меняется при изменении формата скомпилированного модлиста - старый кэш просто не найдётся
+CACHE_FORMAT = 2
+MAX_CACHE_ENTRIES = 32
+
+_SHA256_RE = re.compile(r"^[0-9a-fA-F]{64}$")
+_INVALID_NAME_CHARS = set('<>:"/\\|?*')
+
+# Кэш в памяти процесса: повторный выбор модпака в GUI не читает даже диск
+_memory_cache: Dict[str, Any] = {}
+
+
+class ModlistError(ValueError):
+    """Модлист или config.json не прошли проверку."""
+
+    def __init__(self, source: str, problems: List[str]):
+        self.problems = problems
+        details = "\n  - ".join(problems[:20])
+        more = f"\n  ... и ещё {len(problems) - 20}" if len(problems) > 20 else ""
+        super().__init__(f"{source}: найдено ошибок: {len(problems)}\n  - {details}{more}")
+
+
+class ModRecord:
+    """Компактная запись мода из модлиста."""
+    __slots__ = ("name", "url", "sha256", "unique_id", "version")
+
+    def __init__(self, name: str, url: str, sha256: Optional[str] = None,
+                 unique_id: Optional[str] = None, version: Optional[str] = None):
+        self.name = name
+        self.url = url
+        self.sha256 = sha256
+        self.unique_id = unique_id
+        self.version = version
+
+    def to_tuple(self):
+        return (self.name, self.url, self.sha256, self.unique_id, self.version)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: v for k, v in zip(self.__slots__, self.to_tuple()) if v is not None}
+
+    def __repr__(self):
+        return f"ModRecord({self.name!r})"
+
+
+class CompiledModlist:
+    """Проверенный модлист, готовый к установке."""
+    __slots__ = ("name", "github_zip_url", "mods")
+
+    def __init__(self, name: Optional[str], github_zip_url: Optional[str], mods: List[ModRecord]):
+        self.name = name
+        self.github_zip_url = github_zip_url
+        self.mods = mods
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"name": self.name, "mods": [mod.to_dict() for mod in self.mods]}
+        if self.github_zip_url:
+            data["github_zip_url"] = self.github_zip_url
+        return data
+
+    def __getstate__(self):
+        # Записи модов храним кортежами (в JSON - списками): так кэш меньше и быстрее грузится
+        return (self.name, self.github_zip_url, [mod.to_tuple() for mod in self.mods])
+
+    def __setstate__(self, state):
+        self.name, self.github_zip_url, mods = state
+        self.mods = [ModRecord(*mod) for mod in mods]
+
+    @classmethod
+    def from_state(cls, state) -> "CompiledModlist":
+        modlist = cls.__new__(cls)
+        modlist.__setstate__(state)
+        return modlist
+
+
+def loads(data: bytes):
+    """Разбирает JSON; использует orjson, если он установлен."""
+    if data.startswith(b"\xef\xbb\xbf"):
+        data = data[3:]
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value) -> bytes:
+    """Сериализует в компактный JSON; использует orjson, если он установлен."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _is_http_url(value) -> bool:
+    if not isinstance(value, str):
+        return False
+    parsed = urlparse(value)
+    return parsed.scheme in ("http", "https") and bool(parsed.netloc)
+
+
+def _check_name(value, where: str, problems: List[str]):
+    """Имя мода становится именем папки и архива - проверяем, что оно безопасно."""
+    if not isinstance(value, str) or not value.strip():
+        problems.append(f"{where}: не указано имя (name)")
+    elif value in (".", "..") or value != value.strip() or _INVALID_NAME_CHARS.intersection(value):
+        problems.append(f"{where}: недопустимое имя папки {value!r}")
+
+
+def compile_modlist(data: Any, source: str = "модлист") -> CompiledModlist:
+    """Проверяет модлист целиком и собирает компактное представление. Бросает ModlistError."""
+    problems: List[str] = []
+    if not isinstance(data, dict):
+        raise ModlistError(source, ["корень модлиста должен быть объектом"])
+
+    github_zip_url = data.get("github_zip_url")
+    if github_zip_url is not None and not _is_http_url(github_zip_url):
+        problems.append(f"github_zip_url: некорректный URL {github_zip_url!r}")
+
+    raw_mods = data.get("mods", [])
+    if not isinstance(raw_mods, list):
+        raise ModlistError(source, ["mods должен быть списком"])
+
+    mods: List[ModRecord] = []
+    seen = set()
+    for i, mod in enumerate(raw_mods, 1):
+        where = f"mods[{i}]"
+        if not isinstance(mod, dict):
+            problems.append(f"{where}: запись должна быть объектом")
+            continue
+        name, url = mod.get("name"), mod.get("url")
+        count = len(problems)
+        _check_name(name, where, problems)
+        if not _is_http_url(url):
+            problems.append(f"{where} ({name}): некорректный или пустой url")
+        sha256 = mod.get("sha256")
+        if sha256 is not None and (not isinstance(sha256, str) or not _SHA256_RE.match(sha256)):
+            problems.append(f"{where} ({name}): sha256 должен быть 64 hex-символами")
+        for key in ("unique_id", "version"):
+            if mod.get(key) is not None and not isinstance(mod.get(key), str):
+                problems.append(f"{where} ({name}): {key} должен быть строкой")
+        if isinstance(name, str):
+            if name.lower() in seen:
+                problems.append(f"{where}: мод {name!r} указан повторно")
+            seen.add(name.lower())
+        if len(problems) == count:
+            mods.append(ModRecord(name, url, sha256.lower() if sha256 else None,
+                                  mod.get("unique_id"), mod.get("version")))
+
+    if problems:
+        raise ModlistError(source, problems)
+    return CompiledModlist(data.get("name"), github_zip_url, mods)
+
+
+def validate_config(data: Any, source: str = "config.json") -> Dict[str, Any]:
+    """Проверяет config.json: список модпаков с name, slug и modlist_url."""
+    problems: List[str] = []
+    if not isinstance(data, dict) or not isinstance(data.get("modpacks", []), list):
+        raise ModlistError(source, ["ожидается объект со списком modpacks"])
+    seen = set()
+    for i, modpack in enumerate(data.get("modpacks", []), 1):
+        where = f"modpacks[{i}]"
+        if not isinstance(modpack, dict):
+            problems.append(f"{where}: запись должна быть объектом")
+            continue
+        if not isinstance(modpack.get("name"), str) or not modpack["name"].strip():
+            problems.append(f"{where}: не указано имя (name)")
+        _check_name(modpack.get("slug"), f"{where} slug", problems)
+        if not _is_http_url(modpack.get("modlist_url")):
+            problems.append(f"{where} ({modpack.get('name')}): некорректный modlist_url")
+        if modpack.get("slug") in seen:
+            problems.append(f"{where}: slug {modpack.get('slug')!r} указан повторно")
+        seen.add(modpack.get("slug"))
+    peers = data.get("lan_peers", [])
+    if not isinstance(peers, list) or not all(isinstance(p, str) for p in peers):
+        problems.append("lan_peers: ожидается список строк")
+    if problems:
+        raise ModlistError(source, problems)
+    return data
+
+
+def _prune(cache_dir: Path):
+    # Файлы *.pickle остались от прежнего формата кэша - удаляем их сразу
+    for legacy in cache_dir.glob("*.pickle"):
+        try:
+            legacy.unlink()
+        except OSError:
+            pass
+    entries = sorted(cache_dir.glob("*.json"), key=lambda f: f.stat().st_mtime)
+    for old in entries[:max(0, len(entries) - MAX_CACHE_ENTRIES)]:
+        try:
+            old.unlink()
+        except OSError:
+            pass
+
+
+def _load_cached(path: Path, cache_dir: Optional[Path], kind: str, build: Callable[[Any], Any],
+                 to_state: Callable[[Any], Any], from_state: Callable[[Any], Any]):
+    """
+    Читает JSON-файл через кэш, ключ которого - sha256 содержимого.
+    Неизменившийся файл не разбирается и не проверяется повторно.
+    На диске кэш хранится в JSON (to_state/from_state), а не в исполняемом формате вроде pickle.
+    """
+    raw = Path(path).read_bytes()
+    key = hashlib.sha256(f"{kind}:{CACHE_FORMAT}:".encode("utf-8") + raw).hexdigest()
+
+    if key in _memory_cache:
+        return _memory_cache[key]
+
+    cache_path = Path(cache_dir) / f"{key}.json" if cache_dir is not None else None
+    if cache_path is not None and cache_path.exists():
+        try:
+            value = from_state(loads(cache_path.read_bytes()))
+            _memory_cache[key] = value
+            logger.debug(f"Скомпилированный {kind} взят из кэша: {Path(path).name}")
+            return value
+        except Exception as e:
+            logger.debug(f"Кэш {cache_path.name} повреждён, разбираю заново: {e}")
+
+    try:
+        data = loads(raw)
+    except ValueError as e:
+        raise ModlistError(Path(path).name, [f"некорректный JSON: {e}"])
+    value = build(data)
+    _memory_cache[key] = value
+
+    if cache_path is not None:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as file:
+                file.write(dumps(to_state(value)))
+            os.replace(tmp_path, cache_path)
+            _prune(cache_path.parent)
+        except OSError as e:
+            logger.debug(f"Не удалось сохранить кэш модлиста: {e}")
+    return value
+
+
+def load_modlist(path: Path, cache_dir: Optional[Path] = None) -> CompiledModlist:
+    """Загружает и проверяет модлист, используя кэш по хэшу содержимого."""
+    return _load_cached(path, cache_dir, "modlist", lambda data: compile_modlist(data, Path(path).name),
+                        CompiledModlist.__getstate__, CompiledModlist.from_state)
+
+
+def load_config(path: Path, cache_dir: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    Загружает и проверяет config.json, используя кэш по хэшу содержимого.
+    Каждый вызов получает свою копию: изменения у одного вызывающего не видны другим.
+    """
+    config = _load_cached(path, cache_dir, "config", lambda data: validate_config(data, Path(path).name),
+                          lambda value: value, lambda state: state)
+    return copy.deepcopy(config)